@@ -4,35 +4,97 @@ Provides REST API endpoints to trigger workflows and send signals
 """
 
 import asyncio
+import itertools
 import logging
-import uuid
+import os
+import queue
+import secrets
+import time
 from contextlib import asynccontextmanager
-from datetime import timedelta
-from typing import Optional, Dict, Any
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, Dict, Any, List, Literal, Tuple
 
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from temporalio.client import Client, WorkflowHandle
 from temporalio.service import RPCError
+import orjson
 
 from sqlalchemy import text
 
-from temporal_app.config import TEMPORAL_HOST, ORDER_TASK_QUEUE
+from temporal_app.config import API_WORKERS, TEMPORAL_HOST, ORDER_TASK_QUEUE, ORDER_RUN_TIMEOUT
 from temporal_app.workflows import OrderWorkflow
-from temporal_app.db import SessionLocal
+from temporal_app.db import AsyncSessionLocal
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Logging: records are handed to a queue and written by a listener thread, so
+# request handlers never block on console/file I/O. Set up in lifespan (not at
+# import): `python -m api.server` imports this module twice, and tests import
+# it without serving.
 logger = logging.getLogger(__name__)
 
+
+def _start_log_listener() -> Tuple[QueueListener, QueueHandler]:
+    """Route root logging through a queue and start the thread that drains it"""
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+    queue_handler = QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener, queue_handler
+
+
+def _stop_log_listener(listener: QueueListener, queue_handler: QueueHandler) -> None:
+    """Detach the queue handler and flush what's queued (the listener thread exits)"""
+    logging.getLogger().removeHandler(queue_handler)
+    listener.stop()
+
 # Global Temporal client
 temporal_client: Optional[Client] = None
 
+# Health payload is static config, so serialize it once at import
+_HEALTH_BYTES = orjson.dumps({
+    "service": "Order Orchestration API",
+    "status": "running",
+    "temporal_host": TEMPORAL_HOST,
+    "task_queue": ORDER_TASK_QUEUE,
+})
+
+# ID generation: a per-process random prefix (pid byte + 3 random bytes) plus a
+# counter, so generating an ID doesn't draw fresh entropy on every request
+_ID_PREFIX = f"{os.getpid() & 0xff:02x}{secrets.token_hex(3)}"
+_ID_COUNTER = itertools.count()
+
+
+def new_id(kind: str) -> str:
+    """Generate a process-unique identifier like ``cust-1a2b3c4d000001``"""
+    return f"{kind}-{_ID_PREFIX}{next(_ID_COUNTER):06x}"
+
+
+# SQL statements, built once and reused by the handlers
+_SQL_SELECT_CUSTOMER_NAME = text("SELECT name FROM customers WHERE id = :id")
+_SQL_INSERT_CUSTOMER = text("""
+    INSERT INTO customers (id, name, email, phone)
+    VALUES (:id, :name, :email, :phone)
+    RETURNING id, name, email, phone, created_at
+""")
+_SQL_SELECT_CUSTOMER = text("SELECT id, name, email, phone, created_at FROM customers WHERE id = :id")
+_SQL_SELECT_ALL_CUSTOMERS = text(
+    "SELECT id, name, email, phone, created_at FROM customers ORDER BY created_at DESC"
+)
+
+# In-process cache of customer_id -> (name, expires_at) for start_order lookups
+CUSTOMER_NAME_CACHE_TTL = 300.0
+CUSTOMER_NAME_CACHE_MAXSIZE = 10_000
+_customer_name_cache: Dict[str, tuple] = {}
+
 
 # Pydantic models for request/response
 class CreateCustomerRequest(BaseModel):
@@ -86,6 +148,11 @@ class WorkflowSearchResult(BaseModel):
     start_time: str
     close_time: Optional[str] = None
 
+class WorkflowSearchResponse(BaseModel):
+    workflows: List[WorkflowSearchResult]
+    count: int
+    query: str
+
 
 # Lifespan context manager
 @asynccontextmanager
@@ -93,14 +160,18 @@ async def lifespan(app: FastAPI):
     """Manage application lifespan"""
     # Startup
     global temporal_client
-    logger.info(f"Connecting to Temporal at {TEMPORAL_HOST}")
-    temporal_client = await Client.connect(TEMPORAL_HOST)
-    logger.info("✓ Connected to Temporal successfully")
+    log_listener, log_handler = _start_log_listener()
+    try:
+        logger.info("Connecting to Temporal at %s", TEMPORAL_HOST)
+        temporal_client = await Client.connect(TEMPORAL_HOST)
+        logger.info("✓ Connected to Temporal successfully")
 
-    yield
+        yield
 
-    # Shutdown
-    logger.info("Shutting down API server")
+        # Shutdown
+        logger.info("Shutting down API server")
+    finally:
+        _stop_log_listener(log_listener, log_handler)
 
 
 # Initialize FastAPI app with lifespan
@@ -108,7 +179,8 @@ app = FastAPI(
     title="Order Orchestration API",
     description="REST API for managing order workflows with Temporal",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -121,34 +193,75 @@ app.add_middleware(
 )
 
 
-# Helper function to get workflow handle
-async def get_workflow_handle(order_id: str) -> WorkflowHandle:
-    """Get a workflow handle by order_id"""
-    if not temporal_client:
-        raise HTTPException(status_code=500, detail="Temporal client not initialized")
+# Dependencies: the client is connected once in lifespan, so the
+# "not initialized" check lives here instead of in every handler. They are
+# async so FastAPI calls them on the event loop instead of via the threadpool.
+async def get_temporal_client() -> Client:
+    """Return the Temporal client connected during startup"""
+    if temporal_client is None:
+        raise HTTPException(status_code=503, detail="Temporal client not initialized")
+    return temporal_client
 
+
+async def get_workflow_handle(
+    order_id: str, client: Client = Depends(get_temporal_client)
+) -> WorkflowHandle:
+    """Get a workflow handle by order_id"""
     try:
-        handle = temporal_client.get_workflow_handle(order_id)
+        handle = client.get_workflow_handle(order_id)
         return handle
     except Exception as e:
-        logger.error(f"Failed to get workflow handle for {order_id}: {e}")
+        logger.error("Failed to get workflow handle for %s: %s", order_id, e)
         raise HTTPException(status_code=404, detail=f"Workflow not found: {order_id}")
 
 
+async def _fetch_customer_name(customer_id: str) -> Optional[str]:
+    """Look up a customer's name in the DB"""
+    async with AsyncSessionLocal() as db:
+        result = (await db.execute(
+            _SQL_SELECT_CUSTOMER_NAME,
+            {"id": customer_id}
+        )).one_or_none()
+    return result.name if result else None
+
+
+async def get_customer_name(customer_id: str) -> Optional[str]:
+    """Get a customer's name, served from a TTL cache when possible"""
+    now = time.monotonic()
+    cached = _customer_name_cache.get(customer_id)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    name = await _fetch_customer_name(customer_id)
+
+    # Only cache hits; a missing customer may be created later
+    if name is not None:
+        if len(_customer_name_cache) >= CUSTOMER_NAME_CACHE_MAXSIZE:
+            _customer_name_cache.pop(next(iter(_customer_name_cache)))
+        _customer_name_cache[customer_id] = (name, now + CUSTOMER_NAME_CACHE_TTL)
+    return name
+
+
+# Escapes backslashes and double quotes in user input for Temporal list filters
+_QUERY_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"'})
+
+
+def quote_query_value(value: str) -> str:
+    """Escape a value for use inside a double-quoted Temporal query literal"""
+    return value.translate(_QUERY_ESCAPES)
+
+
 # Root endpoint
 @app.get("/")
 async def root():
     """API health check"""
-    return {
-        "service": "Order Orchestration API",
-        "status": "running",
-        "temporal_host": TEMPORAL_HOST,
-        "task_queue": ORDER_TASK_QUEUE
-    }
+    return Response(_HEALTH_BYTES, media_type="application/json")
 
 
 # Customer Management Endpoints
-@app.post("/customers", response_model=CustomerResponse)
+# Responses are built with model_construct from trusted DB rows; response_model=None
+# skips FastAPI's re-validation while `responses=` keeps the OpenAPI schema.
+@app.post("/customers", response_model=None, responses={200: {"model": CustomerResponse}})
 async def create_customer(customer: CreateCustomerRequest):
     """
     Create a new customer
@@ -157,31 +270,23 @@ async def create_customer(customer: CreateCustomerRequest):
     - **email**: Customer's email (must be unique)
     - **phone**: Optional phone number
     """
-    customer_id = f"cust-{uuid.uuid4().hex[:8]}"
+    customer_id = new_id("cust")
 
     try:
-        with SessionLocal() as db, db.begin():
-            db.execute(
-                text("""
-                    INSERT INTO customers (id, name, email, phone)
-                    VALUES (:id, :name, :email, :phone)
-                """),
+        async with AsyncSessionLocal() as db, db.begin():
+            result = (await db.execute(
+                _SQL_INSERT_CUSTOMER,
                 {
                     "id": customer_id,
                     "name": customer.name,
                     "email": customer.email,
                     "phone": customer.phone,
                 },
-            )
-
-            result = db.execute(
-                text("SELECT id, name, email, phone, created_at FROM customers WHERE id = :id"),
-                {"id": customer_id}
-            ).one()
+            )).one()
 
-        logger.info(f"✓ Customer created: {customer_id}")
+        logger.info("✓ Customer created: %s", customer_id)
 
-        return CustomerResponse(
+        return CustomerResponse.model_construct(
             id=result.id,
             name=result.name,
             email=result.email,
@@ -190,11 +295,11 @@ async def create_customer(customer: CreateCustomerRequest):
         )
 
     except Exception as e:
-        logger.error(f"Failed to create customer: {e}")
+        logger.error("Failed to create customer: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to create customer: {str(e)}")
 
 
-@app.get("/customers/{customer_id}", response_model=CustomerResponse)
+@app.get("/customers/{customer_id}", response_model=None, responses={200: {"model": CustomerResponse}})
 async def get_customer(customer_id: str):
     """
     Get customer by ID
@@ -202,16 +307,16 @@ async def get_customer(customer_id: str):
     - **customer_id**: Customer identifier
     """
     try:
-        with SessionLocal() as db:
-            result = db.execute(
-                text("SELECT id, name, email, phone, created_at FROM customers WHERE id = :id"),
+        async with AsyncSessionLocal() as db:
+            result = (await db.execute(
+                _SQL_SELECT_CUSTOMER,
                 {"id": customer_id}
-            ).one_or_none()
+            )).one_or_none()
 
         if not result:
             raise HTTPException(status_code=404, detail=f"Customer not found: {customer_id}")
 
-        return CustomerResponse(
+        return CustomerResponse.model_construct(
             id=result.id,
             name=result.name,
             email=result.email,
@@ -222,36 +327,55 @@ async def get_customer(customer_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to get customer: {e}")
+        logger.error("Failed to get customer: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to get customer: {str(e)}")
 
 
+def _customer_row(row) -> Dict[str, Any]:
+    """Convert a customers row into its JSON-ready dict"""
+    return {
+        "id": row.id,
+        "name": row.name,
+        "email": row.email,
+        "phone": row.phone,
+        "created_at": str(row.created_at),
+    }
+
+
+async def _stream_customers_ndjson():
+    """Yield customers one NDJSON line at a time from a server-side cursor"""
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(_SQL_SELECT_ALL_CUSTOMERS)
+        async for row in result:
+            yield orjson.dumps(_customer_row(row)) + b"\n"
+
+
 @app.get("/customers")
-async def list_customers():
+async def list_customers(
+    output_format: Literal["json", "ndjson"] = Query("json", alias="format"),
+):
     """
     List all customers
+
+    - **format**: `json` (default) for a single document, or `ndjson` to stream
+      one customer per line without loading the whole table in memory
     """
+    if output_format == "ndjson":
+        return StreamingResponse(_stream_customers_ndjson(), media_type="application/x-ndjson")
+
     try:
-        with SessionLocal() as db:
-            results = db.execute(
-                text("SELECT id, name, email, phone, created_at FROM customers ORDER BY created_at DESC")
-            ).fetchall()
-
-        customers = [
-            CustomerResponse(
-                id=row.id,
-                name=row.name,
-                email=row.email,
-                phone=row.phone,
-                created_at=str(row.created_at),
-            )
-            for row in results
-        ]
+        async with AsyncSessionLocal() as db:
+            results = (await db.execute(
+                _SQL_SELECT_ALL_CUSTOMERS
+            )).fetchall()
+
+        # Plain dicts returned via ORJSONResponse skip jsonable_encoder entirely
+        customers = [_customer_row(row) for row in results]
 
-        return {"customers": customers, "count": len(customers)}
+        return ORJSONResponse({"customers": customers, "count": len(customers)})
 
     except Exception as e:
-        logger.error(f"Failed to list customers: {e}")
+        logger.error("Failed to list customers: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to list customers: {str(e)}")
 
 
@@ -259,7 +383,8 @@ async def list_customers():
 @app.post("/orders/{order_id}/start", response_model=StartOrderResponse)
 async def start_order(
     order_id: str,
-    request: StartOrderRequest
+    request: StartOrderRequest,
+    client: Client = Depends(get_temporal_client),
 ):
     """
     Start a new OrderWorkflow
@@ -271,50 +396,40 @@ async def start_order(
     - **order_total**: Total order amount (default: 100.0)
     - **priority**: Order priority: NORMAL, HIGH, URGENT (default: NORMAL)
     """
-    if not temporal_client:
-        raise HTTPException(status_code=500, detail="Temporal client not initialized")
-
     # Fetch customer name if not provided
     customer_name = request.customer_name
     if not customer_name:
         try:
-            with SessionLocal() as db:
-                result = db.execute(
-                    text("SELECT name FROM customers WHERE id = :id"),
-                    {"id": request.customer_id}
-                ).one_or_none()
-
-                if not result:
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"Customer not found: {request.customer_id}"
-                    )
-
-                customer_name = result.name
+            customer_name = await get_customer_name(request.customer_id)
+            if not customer_name:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Customer not found: {request.customer_id}"
+                )
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"Failed to fetch customer: {e}")
+            logger.error("Failed to fetch customer: %s", e)
             raise HTTPException(status_code=500, detail=f"Failed to fetch customer: {str(e)}")
 
     # Generate payment_id if not provided
-    payment_id = request.payment_id if request.payment_id else f"payment-{uuid.uuid4().hex[:8]}"
+    payment_id = request.payment_id if request.payment_id else new_id("payment")
 
     logger.info(
-        f"Starting OrderWorkflow for order_id={order_id}, customer_id={request.customer_id}, "
-        f"customer_name={customer_name}, payment_id={payment_id}"
+        "Starting OrderWorkflow for order_id=%s, customer_id=%s, customer_name=%s, payment_id=%s",
+        order_id, request.customer_id, customer_name, payment_id,
     )
 
     try:
-        handle = await temporal_client.start_workflow(
+        handle = await client.start_workflow(
             OrderWorkflow.run,
             args=[order_id, payment_id, request.customer_id, customer_name, request.order_total, request.priority],
             id=order_id,
             task_queue=ORDER_TASK_QUEUE,
-            run_timeout=timedelta(seconds=15),
+            run_timeout=ORDER_RUN_TIMEOUT,
         )
 
-        logger.info(f"✓ Workflow started: {handle.id}")
+        logger.info("✓ Workflow started: %s", handle.id)
 
         return StartOrderResponse(
             order_id=order_id,
@@ -326,13 +441,13 @@ async def start_order(
         )
 
     except Exception as e:
-        logger.error(f"Failed to start workflow: {e}")
+        logger.error("Failed to start workflow: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to start workflow: {str(e)}")
 
 
 # Send cancel signal
 @app.post("/orders/{order_id}/signals/cancel")
-async def cancel_order(order_id: str):
+async def cancel_order(order_id: str, handle: WorkflowHandle = Depends(get_workflow_handle)):
     """
     Send cancel_order signal to a running workflow
 
@@ -340,13 +455,12 @@ async def cancel_order(order_id: str):
 
     Note: Order can only be cancelled before payment is charged
     """
-    logger.info(f"Sending cancel_order signal to {order_id}")
+    logger.info("Sending cancel_order signal to %s", order_id)
 
     try:
-        handle = await get_workflow_handle(order_id)
         await handle.signal(OrderWorkflow.cancel_order)
 
-        logger.info(f"✓ Cancel signal sent to {order_id}")
+        logger.info("✓ Cancel signal sent to %s", order_id)
 
         return {
             "order_id": order_id,
@@ -358,13 +472,17 @@ async def cancel_order(order_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to send cancel signal: {e}")
+        logger.error("Failed to send cancel signal: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to send signal: {str(e)}")
 
 
 # Send update address signal
 @app.post("/orders/{order_id}/signals/update-address")
-async def update_address(order_id: str, address: UpdateAddressRequest):
+async def update_address(
+    order_id: str,
+    address: UpdateAddressRequest,
+    handle: WorkflowHandle = Depends(get_workflow_handle),
+):
     """
     Send update_address signal to a running workflow
 
@@ -373,15 +491,14 @@ async def update_address(order_id: str, address: UpdateAddressRequest):
 
     Note: Address can only be updated before shipping starts
     """
-    logger.info(f"Sending update_address signal to {order_id}")
+    logger.info("Sending update_address signal to %s", order_id)
 
-    address_dict = address.dict()
+    address_dict = address.model_dump()
 
     try:
-        handle = await get_workflow_handle(order_id)
         await handle.signal(OrderWorkflow.update_address, address_dict)
 
-        logger.info(f"✓ Update address signal sent to {order_id}")
+        logger.info("✓ Update address signal sent to %s", order_id)
 
         return {
             "order_id": order_id,
@@ -394,13 +511,13 @@ async def update_address(order_id: str, address: UpdateAddressRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to send update address signal: {e}")
+        logger.error("Failed to send update address signal: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to send signal: {str(e)}")
 
 
 # Send approve signal
 @app.post("/orders/{order_id}/signals/approve")
-async def approve_order(order_id: str):
+async def approve_order(order_id: str, handle: WorkflowHandle = Depends(get_workflow_handle)):
     """
     Send approve_order signal to continue workflow after manual review
 
@@ -408,13 +525,12 @@ async def approve_order(order_id: str):
 
     This signal allows the workflow to proceed from AWAITING_MANUAL_APPROVAL to payment processing
     """
-    logger.info(f"Sending approve_order signal to {order_id}")
+    logger.info("Sending approve_order signal to %s", order_id)
 
     try:
-        handle = await get_workflow_handle(order_id)
         await handle.signal(OrderWorkflow.approve_order)
 
-        logger.info(f"✓ Approve signal sent to {order_id}")
+        logger.info("✓ Approve signal sent to %s", order_id)
 
         return {
             "order_id": order_id,
@@ -426,13 +542,13 @@ async def approve_order(order_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to send approve signal: {e}")
+        logger.error("Failed to send approve signal: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to send signal: {str(e)}")
 
 
 # Query workflow status
-@app.get("/orders/{order_id}/status", response_model=StatusResponse)
-async def get_order_status(order_id: str):
+@app.get("/orders/{order_id}/status", response_model=None, responses={200: {"model": StatusResponse}})
+async def get_order_status(order_id: str, handle: WorkflowHandle = Depends(get_workflow_handle)):
     """
     Query the current status of an order workflow
 
@@ -440,25 +556,30 @@ async def get_order_status(order_id: str):
 
     Returns current workflow state, whether it's running, and detailed status information
     """
-    logger.info(f"Querying status for {order_id}")
+    logger.info("Querying status for %s", order_id)
 
     try:
-        handle = await get_workflow_handle(order_id)
 
-        # Check if workflow is running
+        # Describe (is it running?) and query the workflow status concurrently
+        description, status_details = await asyncio.gather(
+            handle.describe(),
+            handle.query(OrderWorkflow.status),
+            return_exceptions=True,
+        )
+
+        # A failed query is fatal; a failed describe only loses is_running
+        if isinstance(status_details, BaseException):
+            raise status_details
+
         is_running = False
-        try:
-            description = await handle.describe()
+        if isinstance(description, BaseException):
+            logger.warning("Could not describe workflow: %s", description)
+        else:
             is_running = description.status.name == "RUNNING"
-        except Exception as e:
-            logger.warning(f"Could not describe workflow: {e}")
-
-        # Query the workflow status
-        status_details = await handle.query(OrderWorkflow.status)
 
-        logger.info(f"✓ Status retrieved for {order_id}: {status_details}")
+        logger.info("✓ Status retrieved for %s: %s", order_id, status_details)
 
-        return StatusResponse(
+        return StatusResponse.model_construct(
             order_id=order_id,
             workflow_state=status_details.get("state", "UNKNOWN"),
             is_running=is_running,
@@ -468,13 +589,13 @@ async def get_order_status(order_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to query workflow status: {e}")
+        logger.error("Failed to query workflow status: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to query status: {str(e)}")
 
 
 # Get workflow result (if completed)
 @app.get("/orders/{order_id}/result")
-async def get_order_result(order_id: str):
+async def get_order_result(order_id: str, handle: WorkflowHandle = Depends(get_workflow_handle)):
     """
     Get the final result of a completed workflow
 
@@ -482,15 +603,14 @@ async def get_order_result(order_id: str):
 
     Note: This will wait for the workflow to complete if it's still running
     """
-    logger.info(f"Getting result for {order_id}")
+    logger.info("Getting result for %s", order_id)
 
     try:
-        handle = await get_workflow_handle(order_id)
 
         # This will wait for the workflow to complete
         result = await handle.result()
 
-        logger.info(f"✓ Result retrieved for {order_id}: {result}")
+        logger.info("✓ Result retrieved for %s: %s", order_id, result)
 
         return {
             "order_id": order_id,
@@ -501,12 +621,12 @@ async def get_order_result(order_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Failed to get workflow result: {e}")
+        logger.error("Failed to get workflow result: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to get result: {str(e)}")
 
 
-# Search/List workflows
-@app.get("/orders")
+# Search/List workflows; the handler returns plain dicts, `responses=` documents them
+@app.get("/orders", responses={200: {"model": WorkflowSearchResponse}})
 async def list_workflows(
     customer_id: Optional[str] = None,
     customer_name: Optional[str] = None,
@@ -514,6 +634,7 @@ async def list_workflows(
     min_total: Optional[float] = None,
     max_total: Optional[float] = None,
     limit: int = 50,
+    client: Client = Depends(get_temporal_client),
 ):
     """
     List and search workflows using Temporal search attributes
@@ -526,70 +647,80 @@ async def list_workflows(
     - **max_total**: Filter by maximum order total
     - **limit**: Maximum number of results (default: 50)
     """
-    if not temporal_client:
-        raise HTTPException(status_code=500, detail="Temporal client not initialized")
-
     try:
         # Build query string for Temporal
         query_parts = []
 
         if customer_id:
-            query_parts.append(f'CustomerId = "{customer_id}"')
+            query_parts.append('CustomerId = "' + quote_query_value(customer_id) + '"')
 
         if customer_name:
-            query_parts.append(f'CustomerName = "{customer_name}"')
+            query_parts.append('CustomerName = "' + quote_query_value(customer_name) + '"')
 
         if priority:
-            query_parts.append(f'Priority = "{priority}"')
+            query_parts.append('Priority = "' + quote_query_value(priority) + '"')
 
         if min_total is not None:
-            query_parts.append(f'OrderTotal >= {min_total}')
+            query_parts.append('OrderTotal >= ' + str(min_total))
 
         if max_total is not None:
-            query_parts.append(f'OrderTotal <= {max_total}')
+            query_parts.append('OrderTotal <= ' + str(max_total))
 
         # Combine query parts
-        query = " AND ".join(query_parts) if query_parts else ""
+        query = " AND ".join(query_parts)
 
-        logger.info(f"Searching workflows with query: {query or '(no filters)'}")
+        logger.info("Searching workflows with query: %s", query or '(no filters)')
 
-        # Execute search
+        # Execute search; page size matches the limit so we don't fetch pages we won't use
         workflows = []
-        async for workflow_exec in temporal_client.list_workflows(query=query):
+        page_size = max(1, min(limit, 1000))
+        async for workflow_exec in client.list_workflows(query=query, page_size=page_size):
             # Extract search attributes
-            search_attrs = workflow_exec.search_attributes or {}
+            attr = (workflow_exec.search_attributes or {}).get
+            close_time = workflow_exec.close_time
 
             workflows.append(
-                WorkflowSearchResult(
-                    workflow_id=workflow_exec.id,
-                    run_id=workflow_exec.run_id,
-                    status=workflow_exec.status.name,
-                    customer_id=search_attrs.get("CustomerId", [""])[0] if "CustomerId" in search_attrs else "",
-                    customer_name=search_attrs.get("CustomerName", [""])[0] if "CustomerName" in search_attrs else "",
-                    order_total=float(search_attrs.get("OrderTotal", [0.0])[0]) if "OrderTotal" in search_attrs else 0.0,
-                    priority=search_attrs.get("Priority", [""])[0] if "Priority" in search_attrs else "",
-                    start_time=str(workflow_exec.start_time),
-                    close_time=str(workflow_exec.close_time) if workflow_exec.close_time else None,
-                )
+                {
+                    "workflow_id": workflow_exec.id,
+                    "run_id": workflow_exec.run_id,
+                    "status": workflow_exec.status.name,
+                    "customer_id": attr("CustomerId", ("",))[0],
+                    "customer_name": attr("CustomerName", ("",))[0],
+                    "order_total": float(attr("OrderTotal", (0.0,))[0]),
+                    "priority": attr("Priority", ("",))[0],
+                    "start_time": str(workflow_exec.start_time),
+                    "close_time": str(close_time) if close_time else None,
+                }
             )
 
             # Limit results
             if len(workflows) >= limit:
                 break
 
-        logger.info(f"✓ Found {len(workflows)} workflows")
+        logger.info("✓ Found %s workflows", len(workflows))
 
-        return {
+        return ORJSONResponse({
             "workflows": workflows,
             "count": len(workflows),
             "query": query or "all workflows",
-        }
+        })
 
     except Exception as e:
-        logger.error(f"Failed to search workflows: {e}")
+        logger.error("Failed to search workflows: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to search workflows: {str(e)}")
 
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+
+    # uvloop + httptools are installed by uvicorn[standard]; uvloop has no Windows build
+    uvicorn.run(
+        "api.server:app",
+        host="0.0.0.0",
+        port=8000,
+        log_level="info",
+        loop="auto" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=API_WORKERS,
+    )
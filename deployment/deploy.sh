@@ -32,8 +32,18 @@ echo "Starting all services..."
 docker compose -f docker-compose.production.yml up -d
 
 echo ""
-echo "Waiting for services to be healthy (30 seconds)..."
-sleep 30
+echo "Waiting for Postgres and Temporal to be ready (up to 120 seconds)..."
+deadline=$((SECONDS + 120))
+until docker exec order-db pg_isready -q -U "${DB_USER:-trellis}" >/dev/null 2>&1 \
+    && docker exec temporal tctl --address temporal:7233 cluster health >/dev/null 2>&1; do
+    if [ "$SECONDS" -ge "$deadline" ]; then
+        echo "❌ Services did not become ready in time"
+        echo "   Check: docker compose -f docker-compose.production.yml logs"
+        exit 1
+    fi
+    sleep 1
+done
+echo "✓ Services are ready"
 
 # Setup search attributes
 echo ""
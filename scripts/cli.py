@@ -4,16 +4,36 @@ Provides commands to start workflows and send signals
 """
 
 import asyncio
-import uuid
 import sys
-from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
 from temporalio.client import Client
 
-from sqlalchemy import text
+from temporal_app.config import TEMPORAL_HOST, ORDER_TASK_QUEUE, ORDER_RUN_TIMEOUT
 
-from temporal_app.config import TEMPORAL_HOST, ORDER_TASK_QUEUE
-from temporal_app.workflows import OrderWorkflow
-from temporal_app.db import SessionLocal
+# Cold-path imports (workflow definitions, which pull in the activity/DB layer,
+# secrets, socket, ...) are deferred into the commands that need them, so
+# usage/errors don't pay for them.
+
+# Temporal client shared by every command run in this process
+_client: Optional[Client] = None
+
+
+async def get_client() -> Client:
+    """Connect to Temporal once and reuse the client for later commands"""
+    global _client
+    if _client is None:
+        import os
+        import socket
+        from temporalio.service import KeepAliveConfig
+
+        # Explicit HTTP/2 keep-alive pings stop idle proxies from closing the
+        # channel during a long `wait`, which would force a reconnect
+        _client = await Client.connect(
+            TEMPORAL_HOST,
+            identity=f"order-cli-{os.getpid()}@{socket.gethostname()}",
+            keep_alive_config=KeepAliveConfig(interval_millis=15_000, timeout_millis=10_000),
+        )
+    return _client
 
 
 async def start_order(
@@ -25,73 +45,102 @@ async def start_order(
     priority: str = "NORMAL",
 ):
     """Start a new order workflow"""
-    client = await Client.connect(TEMPORAL_HOST)
+    import secrets
+    from temporal_app.workflows import OrderWorkflow
+
+    client = await get_client()
 
     # Generate IDs if not provided
     if not order_id:
-        order_id = f"order-{uuid.uuid4().hex[:8]}"
+        order_id = f"order-{secrets.token_hex(4)}"
     if not payment_id:
-        payment_id = f"payment-{uuid.uuid4().hex[:8]}"
+        payment_id = f"payment-{secrets.token_hex(4)}"
     if not customer_id:
-        customer_id = f"cust-{uuid.uuid4().hex[:8]}"
+        customer_id = f"cust-{secrets.token_hex(4)}"
 
-    # Create customer if not exists (for demo purposes)
+    # The workflow creates the customer if it doesn't exist (create_customer=True,
+    # for demo purposes)
     if not customer_name:
         customer_name = f"Customer {customer_id[-4:]}"
 
-    # Check if customer exists, create if not
-    with SessionLocal() as db, db.begin():
-        existing = db.execute(
-            text("SELECT id FROM customers WHERE id = :id"),
-            {"id": customer_id}
-        ).one_or_none()
-
-        if not existing:
-            db.execute(
-                text("""
-                    INSERT INTO customers (id, name, email)
-                    VALUES (:id, :name, :email)
-                """),
-                {
-                    "id": customer_id,
-                    "name": customer_name,
-                    "email": f"{customer_id}@example.com",
-                },
-            )
-            print(f"✓ Created customer: {customer_id} ({customer_name})")
-
-    print(f"\n🚀 Starting OrderWorkflow")
-    print(f"   Order ID: {order_id}")
-    print(f"   Payment ID: {payment_id}")
-    print(f"   Customer ID: {customer_id}")
-    print(f"   Customer Name: {customer_name}")
-    print(f"   Order Total: ${order_total:.2f}")
-    print(f"   Priority: {priority}")
-    print(f"   Task Queue: {ORDER_TASK_QUEUE}")
+    sys.stdout.write(
+        f"\n🚀 Starting OrderWorkflow\n"
+        f"   Order ID: {order_id}\n"
+        f"   Payment ID: {payment_id}\n"
+        f"   Customer ID: {customer_id}\n"
+        f"   Customer Name: {customer_name}\n"
+        f"   Order Total: ${order_total:.2f}\n"
+        f"   Priority: {priority}\n"
+        f"   Task Queue: {ORDER_TASK_QUEUE}\n"
+    )
 
     handle = await client.start_workflow(
         OrderWorkflow.run,
-        args=[order_id, payment_id, customer_id, customer_name, order_total, priority],
+        args=[order_id, payment_id, customer_id, customer_name, order_total, priority, True],
         id=order_id,
         task_queue=ORDER_TASK_QUEUE,
-        run_timeout=timedelta(seconds=15),
+        run_timeout=ORDER_RUN_TIMEOUT,
+    )
+
+    sys.stdout.write(
+        f"\n✓ Workflow started!\n"
+        f"   Workflow ID: {handle.id}\n"
+        f"   Run ID: {handle.result_run_id}\n"
+        f"\n⏳ Workflow is now waiting for manual approval...\n"
+        f"\nTo approve this order, run:\n"
+        f"   python -m scripts.cli approve {order_id}\n"
+        f"\nTo cancel this order, run:\n"
+        f"   python -m scripts.cli cancel {order_id}\n"
+        f"\nTo check status, run:\n"
+        f"   python -m scripts.cli status {order_id}\n"
+    )
+
+
+async def start_batch(count: int, order_total: float = 100.0, priority: str = "NORMAL"):
+    """Start many order workflows concurrently on the shared client"""
+    import secrets
+    from temporal_app.workflows import OrderWorkflow
+
+    client = await get_client()
+
+    # Pre-generate (order_id, payment_id, customer_id, customer_name) per order
+    token_hex = secrets.token_hex
+    orders = [
+        (f"order-{token_hex(4)}", f"payment-{token_hex(4)}", f"cust-{suffix}", f"Customer {suffix[-4:]}")
+        for suffix in [token_hex(4) for _ in range(count)]
+    ]
+
+    print(f"\n🚀 Starting {count} OrderWorkflows on {ORDER_TASK_QUEUE}...")
+
+    results = await asyncio.gather(
+        *[
+            client.start_workflow(
+                OrderWorkflow.run,
+                args=[order_id, payment_id, customer_id, customer_name, order_total, priority, True],
+                id=order_id,
+                task_queue=ORDER_TASK_QUEUE,
+                run_timeout=ORDER_RUN_TIMEOUT,
+            )
+            for order_id, payment_id, customer_id, customer_name in orders
+        ],
+        return_exceptions=True,
     )
 
-    print(f"\n✓ Workflow started!")
-    print(f"   Workflow ID: {handle.id}")
-    print(f"   Run ID: {handle.result_run_id}")
-    print(f"\n⏳ Workflow is now waiting for manual approval...")
-    print(f"\nTo approve this order, run:")
-    print(f"   python -m scripts.cli approve {order_id}")
-    print(f"\nTo cancel this order, run:")
-    print(f"   python -m scripts.cli cancel {order_id}")
-    print(f"\nTo check status, run:")
-    print(f"   python -m scripts.cli status {order_id}")
+    failed = 0
+    for (order_id, *_), result in zip(orders, results):
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"   ❌ {order_id}: {result}")
+        else:
+            print(f"   ✓ {order_id}")
+
+    print(f"\n✓ Started {count - failed}/{count} workflows")
 
 
 async def approve_order(order_id: str):
     """Send approve signal to a workflow"""
-    client = await Client.connect(TEMPORAL_HOST)
+    from temporal_app.workflows import OrderWorkflow
+    client = await get_client()
 
     print(f"\n✓ Sending approve_order signal to {order_id}...")
 
@@ -104,7 +153,8 @@ async def approve_order(order_id: str):
 
 async def cancel_order(order_id: str):
     """Send cancel signal to a workflow"""
-    client = await Client.connect(TEMPORAL_HOST)
+    from temporal_app.workflows import OrderWorkflow
+    client = await get_client()
 
     print(f"\n⚠️  Sending cancel_order signal to {order_id}...")
 
@@ -117,7 +167,8 @@ async def cancel_order(order_id: str):
 
 async def update_address(order_id: str, street: str, city: str, state: str, zip_code: str):
     """Send update address signal to a workflow"""
-    client = await Client.connect(TEMPORAL_HOST)
+    from temporal_app.workflows import OrderWorkflow
+    client = await get_client()
 
     address = {
         "street": street,
@@ -138,40 +189,49 @@ async def update_address(order_id: str, street: str, city: str, state: str, zip_
 
 async def get_status(order_id: str):
     """Query workflow status"""
-    client = await Client.connect(TEMPORAL_HOST)
+    from temporal_app.workflows import OrderWorkflow
+    client = await get_client()
 
     print(f"\n🔍 Querying status for {order_id}...")
 
     handle = client.get_workflow_handle(order_id)
 
-    # Get workflow description
-    try:
-        description = await handle.describe()
-        print(f"\n📊 Workflow Status:")
-        print(f"   Status: {description.status.name}")
-        print(f"   Run ID: {description.run_id}")
-        print(f"   Start Time: {description.start_time}")
-    except Exception as e:
-        print(f"   Could not get workflow description: {e}")
+    # Describe the execution and query custom status concurrently
+    description, status = await asyncio.gather(
+        handle.describe(),
+        handle.query(OrderWorkflow.status),
+        return_exceptions=True,
+    )
 
-    # Query custom status
-    try:
-        status = await handle.query(OrderWorkflow.status)
-        print(f"\n📋 Order Details:")
-        print(f"   State: {status.get('state')}")
-        print(f"   Cancelled: {status.get('cancelled', False)}")
-        print(f"   Manual Review Approved: {status.get('manual_review_approved', False)}")
+    if isinstance(description, Exception):
+        print(f"   Could not get workflow description: {description}")
+    else:
+        sys.stdout.write(
+            f"\n📊 Workflow Status:\n"
+            f"   Status: {description.status.name}\n"
+            f"   Run ID: {description.run_id}\n"
+            f"   Start Time: {description.start_time}\n"
+        )
+
+    if isinstance(status, Exception):
+        print(f"   Could not query workflow status: {status}")
+    else:
+        lines = [
+            "\n📋 Order Details:",
+            f"   State: {status.get('state')}",
+            f"   Cancelled: {status.get('cancelled', False)}",
+            f"   Manual Review Approved: {status.get('manual_review_approved', False)}",
+        ]
         if status.get('updated_address'):
-            print(f"   Updated Address: {status.get('updated_address')}")
+            lines.append(f"   Updated Address: {status.get('updated_address')}")
         if status.get('last_error'):
-            print(f"   Last Error: {status.get('last_error')}")
-    except Exception as e:
-        print(f"   Could not query workflow status: {e}")
+            lines.append(f"   Last Error: {status.get('last_error')}")
+        sys.stdout.write("\n".join(lines) + "\n")
 
 
 async def wait_for_result(order_id: str):
     """Wait for workflow result"""
-    client = await Client.connect(TEMPORAL_HOST)
+    client = await get_client()
 
     print(f"\n⏳ Waiting for workflow {order_id} to complete...")
 
@@ -182,97 +242,122 @@ async def wait_for_result(order_id: str):
         print(f"\n✓ Workflow completed!")
         print(f"   Result: {result}")
 
-        status = await handle.query(OrderWorkflow.status)
-        print(f"   Final State: {status.get('state')}")
+        # OrderWorkflow only returns normally as CANCELLED or after COMPLETED,
+        # so the final state follows from the result without another query
+        print(f"   Final State: {'CANCELLED' if result == 'CANCELLED' else 'COMPLETED'}")
     except Exception as e:
         print(f"\n❌ Workflow failed or was cancelled")
         print(f"   Error: {e}")
 
 
+_USAGE = """
+📦 Order Orchestration CLI
+
+Usage:
+  python -m scripts.cli <command> [arguments]
+
+Commands:
+  start [order_id] [payment_id] [customer_id] [customer_name] [order_total] [priority]
+                                  - Start a new order workflow
+                                    All arguments are optional
+                                    Priority: NORMAL, HIGH, URGENT (default: NORMAL)
+  start-batch <count> [order_total] [priority]
+                                  - Start <count> orders concurrently
+  approve <order_id>              - Approve an order (manual review)
+  cancel <order_id>               - Cancel an order
+  update-address <order_id> <street> <city> <state> <zip>
+                                  - Update shipping address
+  status <order_id>               - Get workflow status
+  wait <order_id>                 - Wait for workflow result
+
+Examples:
+  python -m scripts.cli start
+  python -m scripts.cli start order-001 payment-001 cust-001 "John Doe" 250.50 HIGH
+  python -m scripts.cli start-batch 100
+  python -m scripts.cli approve order-abc123
+  python -m scripts.cli cancel order-abc123
+  python -m scripts.cli update-address order-abc123 "123 Main St" "New York" "NY" "10001"
+  python -m scripts.cli status order-abc123
+
+"""
+
+
 def print_usage():
     """Print usage information"""
-    print("\n📦 Order Orchestration CLI")
-    print("\nUsage:")
-    print("  python -m scripts.cli <command> [arguments]")
-    print("\nCommands:")
-    print("  start [order_id] [payment_id] [customer_id] [customer_name] [order_total] [priority]")
-    print("                                  - Start a new order workflow")
-    print("                                    All arguments are optional")
-    print("                                    Priority: NORMAL, HIGH, URGENT (default: NORMAL)")
-    print("  approve <order_id>              - Approve an order (manual review)")
-    print("  cancel <order_id>               - Cancel an order")
-    print("  update-address <order_id> <street> <city> <state> <zip>")
-    print("                                  - Update shipping address")
-    print("  status <order_id>               - Get workflow status")
-    print("  wait <order_id>                 - Wait for workflow result")
-    print("\nExamples:")
-    print("  python -m scripts.cli start")
-    print("  python -m scripts.cli start order-001 payment-001 cust-001 \"John Doe\" 250.50 HIGH")
-    print("  python -m scripts.cli approve order-abc123")
-    print("  python -m scripts.cli cancel order-abc123")
-    print("  python -m scripts.cli update-address order-abc123 \"123 Main St\" \"New York\" \"NY\" \"10001\"")
-    print("  python -m scripts.cli status order-abc123")
-    print()
+    sys.stdout.write(_USAGE)
+
+
+def _parse_start(argv):
+    argc = len(argv)
+    return (
+        argv[2] if argc > 2 else None,
+        argv[3] if argc > 3 else None,
+        argv[4] if argc > 4 else None,
+        argv[5] if argc > 5 else None,
+        float(argv[6]) if argc > 6 else 100.0,
+        argv[7] if argc > 7 else "NORMAL",
+    )
+
+
+def _parse_start_batch(argv):
+    argc = len(argv)
+    return (
+        int(argv[2]),
+        float(argv[3]) if argc > 3 else 100.0,
+        argv[4] if argc > 4 else "NORMAL",
+    )
+
+
+def _parse_order_id(argv):
+    return (argv[2],)
+
+
+def _parse_update_address(argv):
+    return tuple(argv[2:7])
+
+
+class Command(NamedTuple):
+    min_argc: int
+    missing_error: Optional[str]
+    parse: Callable[[List[str]], tuple]
+    run: Callable[..., Awaitable[None]]
+
+
+# command name -> (min len(argv), error when too short, argv parser, coroutine)
+COMMANDS: Dict[str, Command] = {
+    "start": Command(2, None, _parse_start, start_order),
+    "start-batch": Command(3, "count required", _parse_start_batch, start_batch),
+    "approve": Command(3, "order_id required", _parse_order_id, approve_order),
+    "cancel": Command(3, "order_id required", _parse_order_id, cancel_order),
+    "update-address": Command(7, "address components required", _parse_update_address, update_address),
+    "status": Command(3, "order_id required", _parse_order_id, get_status),
+    "wait": Command(3, "order_id required", _parse_order_id, wait_for_result),
+}
 
 
 async def main():
     """Main CLI entry point"""
-    if len(sys.argv) < 2:
+    argv = sys.argv
+    argc = len(argv)
+    if argc < 2:
         print_usage()
         sys.exit(1)
 
-    command = sys.argv[1].lower()
+    command = argv[1].lower()
+    cmd = COMMANDS.get(command)
 
-    try:
-        if command == "start":
-            order_id = sys.argv[2] if len(sys.argv) > 2 else None
-            payment_id = sys.argv[3] if len(sys.argv) > 3 else None
-            customer_id = sys.argv[4] if len(sys.argv) > 4 else None
-            customer_name = sys.argv[5] if len(sys.argv) > 5 else None
-            order_total = float(sys.argv[6]) if len(sys.argv) > 6 else 100.0
-            priority = sys.argv[7] if len(sys.argv) > 7 else "NORMAL"
-            await start_order(order_id, payment_id, customer_id, customer_name, order_total, priority)
-
-        elif command == "approve":
-            if len(sys.argv) < 3:
-                print("❌ Error: order_id required")
-                print_usage()
-                sys.exit(1)
-            await approve_order(sys.argv[2])
-
-        elif command == "cancel":
-            if len(sys.argv) < 3:
-                print("❌ Error: order_id required")
-                print_usage()
-                sys.exit(1)
-            await cancel_order(sys.argv[2])
-
-        elif command == "update-address":
-            if len(sys.argv) < 7:
-                print("❌ Error: address components required")
-                print_usage()
-                sys.exit(1)
-            await update_address(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6])
-
-        elif command == "status":
-            if len(sys.argv) < 3:
-                print("❌ Error: order_id required")
-                print_usage()
-                sys.exit(1)
-            await get_status(sys.argv[2])
-
-        elif command == "wait":
-            if len(sys.argv) < 3:
-                print("❌ Error: order_id required")
-                print_usage()
-                sys.exit(1)
-            await wait_for_result(sys.argv[2])
+    if cmd is None:
+        print(f"❌ Unknown command: {command}")
+        print_usage()
+        sys.exit(1)
 
-        else:
-            print(f"❌ Unknown command: {command}")
-            print_usage()
-            sys.exit(1)
+    if argc < cmd.min_argc:
+        print(f"❌ Error: {cmd.missing_error}")
+        print_usage()
+        sys.exit(1)
 
+    try:
+        await cmd.run(*cmd.parse(argv))
     except KeyboardInterrupt:
         print("\n\n👋 Interrupted by user")
     except Exception as e:
@@ -7,10 +7,22 @@ Search attributes enable querying and filtering workflows by custom fields.
 
 import asyncio
 from temporalio.client import Client
+from temporalio.api.enums.v1 import IndexedValueType
+from temporalio.api.operatorservice.v1 import AddSearchAttributesRequest, ListSearchAttributesRequest
 from temporalio.service import OperatorServiceStubs
 
 from temporal_app.config import TEMPORAL_HOST
 
+# Search attribute type names -> Temporal indexed value types
+TYPE_MAP = {
+    "Keyword": IndexedValueType.INDEXED_VALUE_TYPE_KEYWORD,
+    "Text": IndexedValueType.INDEXED_VALUE_TYPE_TEXT,
+    "Double": IndexedValueType.INDEXED_VALUE_TYPE_DOUBLE,
+    "Int": IndexedValueType.INDEXED_VALUE_TYPE_INT,
+    "Bool": IndexedValueType.INDEXED_VALUE_TYPE_BOOL,
+    "Datetime": IndexedValueType.INDEXED_VALUE_TYPE_DATETIME,
+}
+
 
 async def setup_search_attributes():
     """Register custom search attributes with Temporal"""
@@ -29,41 +41,42 @@ async def setup_search_attributes():
         "Priority": "Keyword",  # Exact match queries (NORMAL, HIGH, URGENT)
     }
 
-    for name, type_name in search_attributes.items():
+    # Note: In Temporal, we need to use the operator service to add search attributes
+    # This is typically done via tctl command line:
+    # tctl admin cluster add-search-attributes --name CustomerId --type Keyword
+
+    # Registration is a read-modify-write of the namespace metadata, so send
+    # every missing attribute in one request (one atomic update) rather than
+    # concurrent per-attribute calls that would race each other
+    existing = (
+        await operator.list_search_attributes(ListSearchAttributesRequest(namespace="default"))
+    ).custom_attributes
+    missing = {
+        name: TYPE_MAP[type_name]
+        for name, type_name in search_attributes.items()
+        if name not in existing
+    }
+
+    error = None
+    if missing:
         try:
-            print(f"  - {name} ({type_name})...", end=" ")
-
-            # Note: In Temporal, we need to use the operator service to add search attributes
-            # This is typically done via tctl command line:
-            # tctl admin cluster add-search-attributes --name CustomerId --type Keyword
-
-            # For programmatic access, we'll use the add_search_attributes method
-            from temporalio.api.operatorservice.v1 import AddSearchAttributesRequest
-            from temporalio.api.enums.v1 import IndexedValueType
-
-            type_map = {
-                "Keyword": IndexedValueType.INDEXED_VALUE_TYPE_KEYWORD,
-                "Text": IndexedValueType.INDEXED_VALUE_TYPE_TEXT,
-                "Double": IndexedValueType.INDEXED_VALUE_TYPE_DOUBLE,
-                "Int": IndexedValueType.INDEXED_VALUE_TYPE_INT,
-                "Bool": IndexedValueType.INDEXED_VALUE_TYPE_BOOL,
-                "Datetime": IndexedValueType.INDEXED_VALUE_TYPE_DATETIME,
-            }
-
-            request = AddSearchAttributesRequest(
-                search_attributes={name: type_map[type_name]},
-                namespace="default",
+            await operator.add_search_attributes(
+                AddSearchAttributesRequest(search_attributes=missing, namespace="default")
             )
+        except Exception as e:
+            error = e
 
-            await operator.add_search_attributes(request)
+    for name, type_name in search_attributes.items():
+        print(f"  - {name} ({type_name})...", end=" ")
+        if name not in missing:
+            print("(already exists)")
+        elif error is None:
             print("✓")
+        else:
+            print(f"✗ Error: {error}")
 
-        except Exception as e:
-            # Attribute might already exist
-            if "already exists" in str(e).lower():
-                print("(already exists)")
-            else:
-                print(f"✗ Error: {e}")
+    if error is not None:
+        raise error
 
     print("\n✓ Search attributes setup complete!")
     print("\nRegistered attributes:")
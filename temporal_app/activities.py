@@ -1,7 +1,9 @@
 from datetime import timedelta
+from types import MappingProxyType
 from temporalio import activity
 
 from . import functions
+from .schemas import Order
 
 
 # Shared timeouts for all activities (will trigger flaky_call sleeps)
@@ -9,40 +11,49 @@ ACTIVITY_SCHEDULE_TO_CLOSE = timedelta(seconds=4)
 ACTIVITY_START_TO_CLOSE = timedelta(seconds=4)
 
 
-def activity_opts():
-    # Helper so we don't repeat kwargs
-    return {
-        "schedule_to_close_timeout": ACTIVITY_SCHEDULE_TO_CLOSE,
-        "start_to_close_timeout": ACTIVITY_START_TO_CLOSE,
-    }
+# Shared kwargs so we don't repeat them; read-only since every workflow shares it
+ACTIVITY_OPTS = MappingProxyType({
+    "schedule_to_close_timeout": ACTIVITY_SCHEDULE_TO_CLOSE,
+    "start_to_close_timeout": ACTIVITY_START_TO_CLOSE,
+})
 
 
 @activity.defn
-async def receive_order_activity(order_id: str, customer_id: str, order_total: float = 0.0, priority: str = "NORMAL"):
+async def ensure_customer_activity(customer_id: str, customer_name: str) -> None:
+    return await functions.customer_ensured(customer_id, customer_name)
+
+
+@activity.defn
+async def receive_order_activity(order_id: str, customer_id: str, order_total: float = 0.0, priority: str = "NORMAL") -> Order:
     # Thin wrapper around business logic
     return await functions.order_received(order_id, customer_id, order_total, priority)
 
 
 @activity.defn
-async def validate_order_activity(order: dict) -> bool:
-    return await functions.order_validated(order)
+async def validate_order_activity(order: Order, write_state: bool = False) -> bool:
+    return await functions.order_validated(order, write_state)
 
 
 @activity.defn
-async def charge_payment_activity(order: dict, payment_id: str) -> dict:
+async def charge_payment_activity(order: Order, payment_id: str) -> dict:
     return await functions.payment_charged(order, payment_id)
 
 
 @activity.defn
-async def mark_order_shipped_activity(order: dict) -> str:
-    return await functions.order_shipped(order)
+async def mark_order_shipped_activity(order: Order, write_state: bool = False) -> str:
+    return await functions.order_shipped(order, write_state)
+
+
+@activity.defn
+async def finalize_order_state_activity(order_id: str, state: str) -> None:
+    return await functions.order_state_finalized(order_id, state)
 
 
 @activity.defn
-async def prepare_package_activity(order: dict) -> str:
-    return await functions.package_prepared(order)
+async def prepare_package_activity(order: Order, write_state: bool = False) -> str:
+    return await functions.package_prepared(order, write_state)
 
 
 @activity.defn
-async def dispatch_carrier_activity(order: dict) -> str:
-    return await functions.carrier_dispatched(order)
+async def dispatch_carrier_activity(order: Order, write_state: bool = False) -> str:
+    return await functions.carrier_dispatched(order, write_state)
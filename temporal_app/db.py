@@ -1,17 +1,77 @@
+from functools import cache, lru_cache
 from pathlib import Path
+from typing import Tuple
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import Engine, create_engine, make_url, text
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
-from .config import DB_URL
+from .config import DB_MAX_OVERFLOW, DB_POOL_SIZE, get_db_url
 
-engine = create_engine(DB_URL, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+# Engines and session factories are built on first use, so importing this
+# module doesn't resolve DB_URL or set up pools.
+
+
+@cache
+def get_engine() -> Engine:
+    # pre_ping drops connections the server closed; recycle retires them before
+    # idle timeouts on proxies/load balancers can kill them mid-query.
+    # Only init_db() still goes through this sync engine.
+    return create_engine(get_db_url(), future=True, pool_pre_ping=True, pool_recycle=1800)
+
+
+@cache
+def get_async_engine() -> AsyncEngine:
+    # Async engine for the FastAPI server, sharing the same database but driven
+    # by asyncpg instead of psycopg2. Activities use the raw asyncpg pool in pg.py.
+    return create_async_engine(
+        make_url(get_db_url()).set(drivername="postgresql+asyncpg"),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        query_cache_size=1200,
+    )
+
+
+@cache
+def get_session_factory() -> sessionmaker:
+    return sessionmaker(bind=get_engine(), autoflush=False, autocommit=False, future=True)
+
+
+@cache
+def get_async_session_factory() -> async_sessionmaker:
+    return async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+
+
+# The old module-level names, resolved lazily through the getters above
+_LAZY_ATTRS = {
+    "engine": get_engine,
+    "SessionLocal": get_session_factory,
+    "async_engine": get_async_engine,
+    "AsyncSessionLocal": get_async_session_factory,
+}
+
+
+def __getattr__(name: str):
+    try:
+        return _LAZY_ATTRS[name]()
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+
+SCHEMA_PATH = Path(__file__).resolve().parents[1] / "db" / "schema.sql"
+
+
+@lru_cache(maxsize=1)
+def _load_schema() -> Tuple[str, ...]:
+    """Read schema.sql once and split it into individual statements."""
+    sql = SCHEMA_PATH.read_text(encoding="utf-8")
+    return tuple(stmt.strip() for stmt in sql.split(";") if stmt.strip())
 
 
 def init_db() -> None:
-    """Run schema.sql against the configured DB."""
-    schema_path = Path(__file__).resolve().parents[1] / "db" / "schema.sql"
-    sql = schema_path.read_text(encoding="utf-8")
-    with engine.begin() as conn:
-        conn.execute(text(sql))
+    """Run schema.sql against the configured DB (every statement is IF NOT EXISTS)."""
+    with get_engine().begin() as conn:
+        for stmt in _load_schema():
+            conn.execute(text(stmt))
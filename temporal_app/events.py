@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from typing import Any, List, Optional, Tuple
+
+import orjson
+
+from .pg import get_pool
+
+logger = logging.getLogger(__name__)
+
+# Event rows from concurrent activities are coalesced and written with a single
+# COPY per batch, instead of one INSERT (and one commit) per activity.
+
+EVENT_COLUMNS = ("order_id", "type", "payload_json")
+
+# How long the flusher waits for more rows after the first one arrives, and
+# the most rows it writes in one COPY
+BATCH_DELAY_SECS = 0.005
+BATCH_MAX_ROWS = 500
+
+_Record = Tuple[str, str, str]
+
+
+class EventBatcher:
+    """Collects event rows on a queue and flushes them in batches.
+
+    put() only returns once the batch holding its row is committed, so an
+    activity never reports success for an event that wasn't written.
+    """
+
+    def __init__(self) -> None:
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        # Also restarts a flusher that died (e.g. cancelled mid-flush), so
+        # later puts aren't left waiting on a queue nobody reads
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="event-batcher")
+
+    async def put(self, order_id: str, type_: str, payload: Any) -> None:
+        """Queue one event row and wait until it has been written."""
+        self.start()
+        done = asyncio.get_running_loop().create_future()
+        # payload_json is TEXT; COPY sends the column as-is
+        self._queue.put_nowait(((order_id, type_, orjson.dumps(payload).decode()), done))
+        await done
+
+    async def close(self) -> None:
+        """Flush whatever is already queued and stop the flusher."""
+        if self._task is not None:
+            self._queue.put_nowait(None)  # sentinel: stop after this batch
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            # Give the other in-flight activities a moment to add their rows
+            await asyncio.sleep(BATCH_DELAY_SECS)
+
+            batch, stop = [first], False
+            while len(batch) < BATCH_MAX_ROWS and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            if stop:
+                return
+
+    async def _flush(self, batch: List) -> None:
+        records: List[_Record] = [record for record, _ in batch]
+        try:
+            pool = await get_pool()
+            async with pool.acquire() as conn:
+                await conn.copy_records_to_table("events", records=records, columns=EVENT_COLUMNS)
+        except Exception as e:
+            logger.error("Failed to write %d event rows: %s", len(records), e)
+            for _, done in batch:
+                if not done.done():
+                    done.set_exception(e)
+        else:
+            for _, done in batch:
+                if not done.done():
+                    done.set_result(None)
+
+
+_batcher: Optional[EventBatcher] = None
+_batcher_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_batcher() -> EventBatcher:
+    """Return this event loop's batcher, creating it on first use."""
+    global _batcher, _batcher_loop
+    loop = asyncio.get_running_loop()
+    if _batcher_loop is not loop:
+        _batcher, _batcher_loop = EventBatcher(), loop
+    return _batcher
+
+
+async def record_event(order_id: str, type_: str, payload: Any) -> None:
+    """Write one event row through the shared batcher."""
+    await get_batcher().put(order_id, type_, payload)
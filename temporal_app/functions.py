@@ -1,223 +1,202 @@
 import asyncio
-import json
 import random
 from typing import Dict, Any
 
-from sqlalchemy import text
-
-from .db import SessionLocal
+import orjson
+from temporalio.exceptions import ApplicationError
+
+from .config import FLAKY_ACTIVITIES, FLAKY_SLEEP_SECS
+from .events import record_event
+from .pg import get_pool
+from .schemas import Order, OrderItem
+
+# Hot-path statements, run through asyncpg (prepared and cached per
+# connection). Each one is a single statement, hence no explicit transaction.
+# Event rows go through the shared EventBatcher (events.record_event), except
+# PAYMENT_CHARGED, which must only be written together with a new payment.
+# Its payload is bound as text already serialized by orjson, in the same
+# compact form the batcher's COPY writes into the TEXT payload_json column.
+
+SQL_INSERT_CUSTOMER = """
+    INSERT INTO customers (id, name, email)
+    VALUES ($1, $2, $3)
+    ON CONFLICT (id) DO NOTHING
+"""
+
+SQL_INSERT_ORDER = """
+    INSERT INTO orders (id, customer_id, state, order_total, priority)
+    VALUES ($1, $2, 'RECEIVED', $3, $4)
+    ON CONFLICT (id) DO NOTHING
+"""
+
+# Insert the payment unless this payment_id was already processed; only a
+# fresh insert moves the order to PAID and records the event. An existing
+# payment's status/amount comes back through the fallback SELECT, except when
+# a concurrent attempt inserted the same payment_id: the fallback runs on this
+# statement's snapshot, which can't see that row, so no row is returned and the
+# caller re-reads it with SQL_SELECT_PAYMENT.
+SQL_CHARGE_PAYMENT = """
+    WITH ins AS (
+        INSERT INTO payments (payment_id, order_id, status, amount)
+        VALUES ($1, $2, 'CHARGED', $3)
+        ON CONFLICT (payment_id) DO NOTHING
+        RETURNING order_id, status, amount
+    ),
+    upd AS (
+        UPDATE orders SET state = 'PAID'
+        WHERE id = (SELECT order_id FROM ins)
+    ),
+    ev AS (
+        INSERT INTO events (order_id, type, payload_json)
+        SELECT order_id, 'PAYMENT_CHARGED', $4::text FROM ins
+    )
+    SELECT status, amount::float8 AS amount FROM ins
+    UNION ALL
+    SELECT status, amount::float8 FROM payments
+    WHERE payment_id = $1 AND NOT EXISTS (SELECT 1 FROM ins)
+"""
+
+SQL_SELECT_PAYMENT = "SELECT status, amount::float8 AS amount FROM payments WHERE payment_id = $1"
+
+# orders.state is only written at the start (RECEIVED), on payment (PAID) and
+# once more when the workflow finishes; the steps in between are events only.
+# Workflows started before that change (unpatched, see OrderWorkflow.run) still
+# have each step write its state (write_state=True).
+SQL_UPDATE_STATE = "UPDATE orders SET state = $2 WHERE id = $1"
 
 
 async def flaky_call() -> None:
     """Either raise an error or sleep long enough to trigger an activity timeout."""
-    # rand_num = random.random()
-    # if rand_num < 0.33:
-    #     raise RuntimeError("Forced failure for testing")
-    # if rand_num < 0.67:
-    #     await asyncio.sleep(300)  # activity timeouts should fire before this
+    if not FLAKY_ACTIVITIES:
+        return
+
+    rand_num = random.random()
+    if rand_num < 0.33:
+        raise RuntimeError("Forced failure for testing")
+    if rand_num < 0.67:
+        # Just past the activity timeout; the timeout fires, the slot frees soon after
+        await asyncio.sleep(FLAKY_SLEEP_SECS)
     # else: succeed immediately
 
 
+async def customer_ensured(customer_id: str, customer_name: str) -> None:
+    """Create the customer row if it doesn't exist yet (idempotent)."""
+    await flaky_call()
+
+    pool = await get_pool()
+    await pool.execute(
+        SQL_INSERT_CUSTOMER, customer_id, customer_name, f"{customer_id}@example.com"
+    )
+
+
 async def order_received(
     order_id: str, customer_id: str, order_total: float = 0.0, priority: str = "NORMAL"
-) -> Dict[str, Any]:
+) -> Order:
     await flaky_call()
 
-    # DB write: insert order row + event
-    with SessionLocal() as db, db.begin():
-        db.execute(
-            text("""
-                INSERT INTO orders (id, customer_id, state, order_total, priority)
-                VALUES (:id, :customer_id, :state, :order_total, :priority)
-                ON CONFLICT (id) DO NOTHING
-            """),
-            {
-                "id": order_id,
-                "customer_id": customer_id,
-                "state": "RECEIVED",
-                "order_total": order_total,
-                "priority": priority,
-            },
-        )
-        db.execute(
-            text("""
-                INSERT INTO events (order_id, type, payload_json)
-                VALUES (:order_id, :type, :payload)
-            """),
-            {
-                "order_id": order_id,
-                "type": "ORDER_RECEIVED",
-                "payload": json.dumps({
-                    "order_id": order_id,
-                    "customer_id": customer_id,
-                    "order_total": order_total,
-                    "priority": priority,
-                }),
-            },
-        )
+    # DB write: insert order row + event. The event is recorded even when the
+    # order row already exists (activity retry).
+    pool = await get_pool()
+    await pool.execute(SQL_INSERT_ORDER, order_id, customer_id, order_total, priority)
+    await record_event(
+        order_id,
+        "ORDER_RECEIVED",
+        {
+            "order_id": order_id,
+            "customer_id": customer_id,
+            "order_total": order_total,
+            "priority": priority,
+        },
+    )
 
     # Return a simple in-memory representation the workflow can carry along
-    return {
-        "order_id": order_id,
-        "customer_id": customer_id,
-        "order_total": order_total,
-        "priority": priority,
-        "items": [{"sku": "ABC", "qty": 1}],
-    }
+    return Order(
+        order_id=order_id,
+        customer_id=customer_id,
+        order_total=order_total,
+        priority=priority,
+        items=[OrderItem(sku="ABC", qty=1)],
+    )
 
 
-async def order_validated(order: Dict[str, Any]) -> bool:
+async def order_validated(order: Order, write_state: bool = False) -> bool:
     await flaky_call()
 
-    if not order.get("items"):
+    if not order.items:
         raise ValueError("No items to validate")
 
-    order_id = order["order_id"]
-
-    with SessionLocal() as db, db.begin():
-        db.execute(
-            text("UPDATE orders SET state = :state WHERE id = :id"),
-            {"state": "VALIDATED", "id": order_id},
-        )
-        db.execute(
-            text("""
-                INSERT INTO events (order_id, type, payload_json)
-                VALUES (:order_id, :type, :payload)
-            """),
-            {
-                "order_id": order_id,
-                "type": "ORDER_VALIDATED",
-                "payload": json.dumps(order),
-            },
-        )
+    if write_state:
+        pool = await get_pool()
+        await pool.execute(SQL_UPDATE_STATE, order.order_id, "VALIDATED")
+    await record_event(order.order_id, "ORDER_VALIDATED", order)
 
     return True
 
 
-async def payment_charged(order: Dict[str, Any], payment_id: str) -> Dict[str, Any]:
+async def payment_charged(order: Order, payment_id: str) -> Dict[str, Any]:
     """
     Charge payment with idempotency based on payment_id.
     This will be called from an activity with retries – idempotency is critical.
     """
     await flaky_call()
 
-    order_id = order["order_id"]
-    amount = order.get("order_total", 0.0)
-
-    with SessionLocal() as db, db.begin():
-        # Check if we already processed this payment_id
-        row = db.execute(
-            text("SELECT status, amount FROM payments WHERE payment_id = :pid"),
-            {"pid": payment_id},
-        ).one_or_none()
-
-        if row:
-            # Idempotent: just return existing status
-            return {"status": row.status, "amount": row.amount}
-
-        # First time seeing this payment_id: insert as CHARGED
-        db.execute(
-            text("""
-                INSERT INTO payments (payment_id, order_id, status, amount)
-                VALUES (:pid, :oid, :status, :amount)
-            """),
-            {
-                "pid": payment_id,
-                "oid": order_id,
-                "status": "CHARGED",
-                "amount": amount,
-            },
-        )
-        db.execute(
-            text("""
-                UPDATE orders SET state = :state WHERE id = :id
-            """),
-            {"state": "PAID", "id": order_id},
-        )
-        db.execute(
-            text("""
-                INSERT INTO events (order_id, type, payload_json)
-                VALUES (:order_id, :type, :payload)
-            """),
-            {
-                "order_id": order_id,
-                "type": "PAYMENT_CHARGED",
-                "payload": json.dumps(
-                    {"payment_id": payment_id, "amount": amount}
-                ),
-            },
-        )
-
-    return {"status": "CHARGED", "amount": amount}
-
-
-async def order_shipped(order: Dict[str, Any]) -> str:
+    order_id = order.order_id
+    amount = order.order_total
+
+    pool = await get_pool()
+    row = await pool.fetchrow(
+        SQL_CHARGE_PAYMENT,
+        payment_id,
+        order_id,
+        amount,
+        orjson.dumps({"payment_id": payment_id, "amount": amount}).decode(),
+    )
+    if row is None:
+        # Lost an insert race for this payment_id; a new statement sees the winner's row
+        row = await pool.fetchrow(SQL_SELECT_PAYMENT, payment_id)
+    if row is None:
+        # The concurrent insert rolled back; the activity retry charges again
+        raise ApplicationError(f"Payment {payment_id} not found after conflicting insert")
+
+    return {"status": row["status"], "amount": row["amount"]}
+
+
+async def order_shipped(order: Order, write_state: bool = False) -> str:
     await flaky_call()
 
-    order_id = order["order_id"]
-    with SessionLocal() as db, db.begin():
-        db.execute(
-            text("UPDATE orders SET state = :state WHERE id = :id"),
-            {"state": "SHIPPED", "id": order_id},
-        )
-        db.execute(
-            text("""
-                INSERT INTO events (order_id, type, payload_json)
-                VALUES (:order_id, :type, :payload)
-            """),
-            {
-                "order_id": order_id,
-                "type": "ORDER_SHIPPED",
-                "payload": json.dumps(order),
-            },
-        )
+    if write_state:
+        pool = await get_pool()
+        await pool.execute(SQL_UPDATE_STATE, order.order_id, "SHIPPED")
+    await record_event(order.order_id, "ORDER_SHIPPED", order)
 
     return "Shipped"
 
 
-async def package_prepared(order: Dict[str, Any]) -> str:
+async def package_prepared(order: Order, write_state: bool = False) -> str:
     await flaky_call()
 
-    order_id = order["order_id"]
-    with SessionLocal() as db, db.begin():
-        db.execute(
-            text("UPDATE orders SET state = :state WHERE id = :id"),
-            {"state": "PACKAGE_PREPARED", "id": order_id},
-        )
-        db.execute(
-            text("""
-                INSERT INTO events (order_id, type, payload_json)
-                VALUES (:order_id, :type, :payload)
-            """),
-            {
-                "order_id": order_id,
-                "type": "PACKAGE_PREPARED",
-                "payload": json.dumps(order),
-            },
-        )
+    if write_state:
+        pool = await get_pool()
+        await pool.execute(SQL_UPDATE_STATE, order.order_id, "PACKAGE_PREPARED")
+    await record_event(order.order_id, "PACKAGE_PREPARED", order)
 
     return "Package ready"
 
 
-async def carrier_dispatched(order: Dict[str, Any]) -> str:
+async def carrier_dispatched(order: Order, write_state: bool = False) -> str:
     await flaky_call()
 
-    order_id = order["order_id"]
-    with SessionLocal() as db, db.begin():
-        db.execute(
-            text("UPDATE orders SET state = :state WHERE id = :id"),
-            {"state": "CARRIER_DISPATCHED", "id": order_id},
-        )
-        db.execute(
-            text("""
-                INSERT INTO events (order_id, type, payload_json)
-                VALUES (:order_id, :type, :payload)
-            """),
-            {
-                "order_id": order_id,
-                "type": "CARRIER_DISPATCHED",
-                "payload": json.dumps(order),
-            },
-        )
+    if write_state:
+        pool = await get_pool()
+        await pool.execute(SQL_UPDATE_STATE, order.order_id, "CARRIER_DISPATCHED")
+    await record_event(order.order_id, "CARRIER_DISPATCHED", order)
 
     return "Dispatched"
+
+
+async def order_state_finalized(order_id: str, state: str) -> None:
+    """Write the order's final state (e.g. SHIPPED, CANCELLED) to its row."""
+    await flaky_call()
+
+    pool = await get_pool()
+    await pool.execute(SQL_UPDATE_STATE, order_id, state)
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+from sqlalchemy import make_url
+
+from .config import DB_MAX_OVERFLOW, DB_POOL_SIZE, get_db_url
+
+logger = logging.getLogger(__name__)
+
+# asyncpg pool for the activity hot path. The activities run a handful of fixed
+# statements, so they skip SQLAlchemy and go straight to asyncpg (binary
+# protocol, per-connection prepared statement cache).
+
+_pool: Optional[asyncpg.Pool] = None
+_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+_pool_lock: Optional[asyncio.Lock] = None
+
+
+async def get_pool() -> asyncpg.Pool:
+    """Create the shared pool on first use and return it."""
+    global _pool, _pool_loop, _pool_lock
+    loop = asyncio.get_running_loop()
+    if _pool_loop is not loop:
+        # First use, or a new event loop (e.g. per-test loops): connections
+        # are bound to the loop that opened them, so start a fresh pool. The
+        # old pool can't be awaited from this loop; terminate() closes its
+        # connections synchronously instead of leaking them.
+        if _pool is not None:
+            try:
+                _pool.terminate()
+            except Exception as e:
+                logger.warning("Failed to terminate the previous loop's pool: %s", e)
+        _pool, _pool_loop, _pool_lock = None, loop, asyncio.Lock()
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                # asyncpg takes a plain libpq-style DSN, without the SQLAlchemy driver suffix
+                dsn = make_url(get_db_url()).set(drivername="postgresql")
+                _pool = await asyncpg.create_pool(
+                    dsn.render_as_string(hide_password=False),
+                    min_size=min(5, DB_POOL_SIZE),
+                    max_size=DB_POOL_SIZE + DB_MAX_OVERFLOW,
+                    statement_cache_size=1024,
+                    # Same role as pool_recycle on the SQLAlchemy engines
+                    max_inactive_connection_lifetime=1800,
+                )
+    return _pool
+
+
+async def close_pool() -> None:
+    """Close the shared pool (worker shutdown)."""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
@@ -0,0 +1,23 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+# Payloads carried through OrderWorkflow/ShippingWorkflow and their activities.
+# Temporal's default converter (de)serializes dataclasses as plain JSON objects,
+# so the history payloads keep the same shape the old dicts had.
+
+
+@dataclass(slots=True)
+class OrderItem:
+    sku: str
+    qty: int = 1
+
+
+@dataclass(slots=True)
+class Order:
+    order_id: str
+    customer_id: str = ""
+    order_total: float = 0.0
+    priority: str = "NORMAL"
+    items: List[OrderItem] = field(default_factory=list)
+    address: Optional[Dict[str, str]] = None
@@ -1,24 +1,21 @@
 import asyncio
 import logging
-from dotenv import load_dotenv
+import sys
 
-# Load environment variables from .env file
-load_dotenv()
-
-from temporalio.client import Client
-from temporalio.worker import Worker
-
-from temporal_app.config import TEMPORAL_HOST, ORDER_TASK_QUEUE, SHIPPING_TASK_QUEUE
-from temporal_app.workflows import OrderWorkflow, ShippingWorkflow
-from temporal_app.activities import (
-    receive_order_activity,
-    validate_order_activity,
-    charge_payment_activity,
-    mark_order_shipped_activity,
-    prepare_package_activity,
-    dispatch_carrier_activity,
+# config loads .env itself (dev only)
+from temporal_app.config import (
+    TEMPORAL_HOST,
+    ORDER_TASK_QUEUE,
+    SHIPPING_TASK_QUEUE,
+    ORDER_MAX_ACTIVITIES,
+    SHIPPING_MAX_ACTIVITIES,
+    MAX_WORKFLOW_TASKS,
+    MAX_CACHED_WORKFLOWS,
 )
 
+# temporalio (grpc/protobuf) and the workflow/activity modules (which pull in
+# the DB layer) are imported inside main(), so importing this module stays cheap.
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -29,6 +26,23 @@ logger = logging.getLogger(__name__)
 
 async def main():
     """Run two workers: one for order processing, one for shipping."""
+    from temporalio.client import Client
+    from temporalio.worker import Worker
+
+    from temporal_app.workflows import OrderWorkflow, ShippingWorkflow
+    from temporal_app.activities import (
+        ensure_customer_activity,
+        receive_order_activity,
+        validate_order_activity,
+        charge_payment_activity,
+        mark_order_shipped_activity,
+        finalize_order_state_activity,
+        prepare_package_activity,
+        dispatch_carrier_activity,
+    )
+    from temporal_app.events import get_batcher
+    from temporal_app.pg import close_pool
+
     logger.info(f"Connecting to Temporal at {TEMPORAL_HOST}")
     client = await Client.connect(TEMPORAL_HOST)
 
@@ -40,11 +54,16 @@ async def main():
         task_queue=ORDER_TASK_QUEUE,
         workflows=[OrderWorkflow],
         activities=[
+            ensure_customer_activity,
             receive_order_activity,
             validate_order_activity,
             charge_payment_activity,
             mark_order_shipped_activity,
+            finalize_order_state_activity,
         ],
+        max_concurrent_activities=ORDER_MAX_ACTIVITIES,
+        max_concurrent_workflow_tasks=MAX_WORKFLOW_TASKS,
+        max_cached_workflows=MAX_CACHED_WORKFLOWS,
     )
 
     # Worker 2: Shipping Processing (shipping-tq)
@@ -58,18 +77,35 @@ async def main():
             prepare_package_activity,
             dispatch_carrier_activity,
         ],
+        max_concurrent_activities=SHIPPING_MAX_ACTIVITIES,
+        max_concurrent_workflow_tasks=MAX_WORKFLOW_TASKS,
+        max_cached_workflows=MAX_CACHED_WORKFLOWS,
     )
 
+    # Event rows from both workers' activities share one batcher (and DB pool)
+    batcher = get_batcher()
+    batcher.start()
+
     # Run both workers concurrently
     logger.info("Starting both workers...")
-    await asyncio.gather(
-        order_worker.run(),
-        shipping_worker.run(),
-    )
+    try:
+        await asyncio.gather(
+            order_worker.run(),
+            shipping_worker.run(),
+        )
+    finally:
+        # Write out queued events before the pool goes away
+        await batcher.close()
+        await close_pool()
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        # uvloop for the gRPC/asyncpg socket I/O; it has no Windows build
+        if sys.platform == "win32":
+            asyncio.run(main())
+        else:
+            import uvloop
+            uvloop.run(main())
     except KeyboardInterrupt:
         logger.info("Workers shutting down...")
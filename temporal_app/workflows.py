@@ -1,23 +1,28 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from enum import IntEnum
 from typing import Optional
 from datetime import timedelta
 import logging
 
 from temporalio import workflow
 from temporalio.exceptions import ActivityError, ChildWorkflowError
-from temporalio.common import SearchAttributeKey
+from temporalio.common import RetryPolicy, SearchAttributeKey, WorkflowIDReusePolicy
 
 from .activities import (
+    ensure_customer_activity,
     receive_order_activity,
     validate_order_activity,
     charge_payment_activity,
     mark_order_shipped_activity,
+    finalize_order_state_activity,
     prepare_package_activity,
     dispatch_carrier_activity,
 )
-from .activities import activity_opts
+from .activities import ACTIVITY_OPTS
+from .config import SHIPPING_TASK_QUEUE
+from .schemas import Order
 
 # Setup logger
 logger = logging.getLogger(__name__)
@@ -28,6 +33,37 @@ CUSTOMER_NAME_ATTR = SearchAttributeKey.for_text("CustomerName")
 ORDER_TOTAL_ATTR = SearchAttributeKey.for_float("OrderTotal")
 PRIORITY_ATTR = SearchAttributeKey.for_keyword("Priority")
 
+# Timers
+MANUAL_APPROVAL_TIMEOUT = timedelta(seconds=30)
+
+# Shipping child workflow: up to 3 attempts, 2s apart
+SHIPPING_RETRY_POLICY = RetryPolicy(
+    initial_interval=timedelta(seconds=2),
+    backoff_coefficient=1.0,
+    maximum_attempts=3,
+)
+
+
+class State(IntEnum):
+    """OrderWorkflow states; the status query reports the name."""
+    INIT = 0
+    RECEIVING = 1
+    VALIDATING = 2
+    AWAITING_MANUAL_APPROVAL = 3
+    CHARGING_PAYMENT = 4
+    SHIPPING = 5
+    SHIPPING_FAILED = 6
+    MARKING_SHIPPED = 7
+    COMPLETED = 8
+    CANCELLED = 9
+
+
+# Signal guards: states (as bits) in which the signal is refused
+NON_CANCELLABLE_MASK = (
+    1 << State.CHARGING_PAYMENT | 1 << State.SHIPPING | 1 << State.MARKING_SHIPPED | 1 << State.COMPLETED
+)
+ADDRESS_LOCKED_MASK = 1 << State.SHIPPING | 1 << State.MARKING_SHIPPED | 1 << State.COMPLETED
+
 
 @workflow.defn
 class ShippingWorkflow:
@@ -36,30 +72,46 @@ class ShippingWorkflow:
         self.last_error: Optional[str] = None
 
     @workflow.run
-    async def run(self, order: dict) -> str:
+    async def run(self, order: Order, write_state: bool = False) -> str:
+        # write_state: set by parents started before the final-state-only
+        # change, whose steps still update the order row themselves
         try:
             self.state = "PREPARING_PACKAGE"
-            workflow.logger.info(f"ShippingWorkflow: Preparing package for order {order.get('order_id')}")
+            workflow.logger.info(
+                "ShippingWorkflow: Preparing package for order %s",
+                order.order_id,
+                extra={"order_id": order.order_id},
+            )
             await workflow.execute_activity(
                 prepare_package_activity,
-                args=[order],
-                **activity_opts(),
+                args=[order, write_state],
+                **ACTIVITY_OPTS,
             )
 
             self.state = "DISPATCHING"
-            workflow.logger.info(f"ShippingWorkflow: Dispatching carrier for order {order.get('order_id')}")
+            workflow.logger.info(
+                "ShippingWorkflow: Dispatching carrier for order %s",
+                order.order_id,
+                extra={"order_id": order.order_id},
+            )
             await workflow.execute_activity(
                 dispatch_carrier_activity,
-                args=[order],
-                **activity_opts(),
+                args=[order, write_state],
+                **ACTIVITY_OPTS,
             )
 
             self.state = "DONE"
-            workflow.logger.info(f"ShippingWorkflow: Successfully completed for order {order.get('order_id')}")
+            workflow.logger.info(
+                "ShippingWorkflow: Successfully completed for order %s",
+                order.order_id,
+                extra={"order_id": order.order_id},
+            )
             return "DISPATCHED"
         except Exception as e:
             self.last_error = str(e)
-            workflow.logger.error(f"ShippingWorkflow: Failed with error: {e}")
+            workflow.logger.error(
+                "ShippingWorkflow: Failed with error: %s", e, extra={"order_id": order.order_id}
+            )
             raise
 
     @workflow.query
@@ -69,49 +121,148 @@ class ShippingWorkflow:
 @workflow.defn
 class OrderWorkflow:
     def __init__(self) -> None:
-        self.state: str = "INIT"
+        self.state: State = State.INIT
         self.last_error: Optional[str] = None
         self.order_cancelled: bool = False
         self.manual_review_approved: bool = False
         self.updated_address: Optional[dict] = None
         self.dispatch_failed_reason: Optional[str] = None
+        # False for runs started before finalize_order_state_activity existed;
+        # those keep writing orders.state at every step (set in run)
+        self.finalize_at_end: bool = True
 
     @workflow.signal
     async def cancel_order(self) -> None:
         """Signal to cancel the order before shipment."""
-        workflow.logger.info(f"OrderWorkflow: Received cancel_order signal in state {self.state}")
-        if self.state not in ["SHIPPING", "MARKING_SHIPPED", "COMPLETED", "CHARGING_PAYMENT"]:
+        workflow.logger.info(
+            "OrderWorkflow: Received cancel_order signal in state %s", self.state.name,
+            extra={"state": self.state.name},
+        )
+        if not (1 << self.state) & NON_CANCELLABLE_MASK:
             self.order_cancelled = True
-            workflow.logger.warning(f"OrderWorkflow: Order cancelled in state {self.state}")
+            workflow.logger.warning(
+                "OrderWorkflow: Order cancelled in state %s",
+                self.state.name,
+                extra={"state": self.state.name},
+            )
         else:
-            workflow.logger.warning(f"OrderWorkflow: Cannot cancel order in state {self.state}")
+            workflow.logger.warning(
+                "OrderWorkflow: Cannot cancel order in state %s",
+                self.state.name,
+                extra={"state": self.state.name},
+            )
 
     @workflow.signal
     async def update_address(self, address: dict) -> None:
         """Signal to update shipping address prior to dispatch."""
-        workflow.logger.info(f"OrderWorkflow: Received update_address signal: {address}")
-        if self.state not in ["SHIPPING", "MARKING_SHIPPED", "COMPLETED"]:
+        workflow.logger.info(
+            "OrderWorkflow: Received update_address signal: %s", address, extra={"address": address}
+        )
+        if not (1 << self.state) & ADDRESS_LOCKED_MASK:
             self.updated_address = address
-            workflow.logger.info(f"OrderWorkflow: Address updated successfully")
+            workflow.logger.info("OrderWorkflow: Address updated successfully")
         else:
-            workflow.logger.warning(f"OrderWorkflow: Cannot update address in state {self.state}")
+            workflow.logger.warning(
+                "OrderWorkflow: Cannot update address in state %s",
+                self.state.name,
+                extra={"state": self.state.name},
+            )
 
     @workflow.signal
     async def approve_order(self) -> None:
         """Signal to approve order after manual review."""
-        workflow.logger.info(f"OrderWorkflow: Received approve_order signal")
+        workflow.logger.info("OrderWorkflow: Received approve_order signal")
         self.manual_review_approved = True
 
     @workflow.query
     def status(self) -> dict:
         return {
-            "state": self.state,
+            "state": self.state.name,
             "last_error": self.last_error,
             "cancelled": self.order_cancelled,
             "updated_address": self.updated_address,
             "manual_review_approved": self.manual_review_approved,
         }
 
+    def _log_step(self, order_id: str, **fields) -> None:
+        """One info line per step; state, order_id and the step's fields go out as
+        structured fields (`extra`) rather than in the message text.
+
+        Arguments are %-formatted by logging only if the record is emitted.
+        """
+        workflow.logger.info(
+            "OrderWorkflow: %s for order %s",
+            self.state.name,
+            order_id,
+            extra={"state": self.state.name, "order_id": order_id, **fields},
+        )
+
+    async def _finalize_state(self, order_id: str, state: str) -> None:
+        """Write the order row's final state; intermediate steps only record events.
+
+        A no-op for unpatched (pre-existing) runs, whose history has no such
+        activity and whose steps already wrote their own state.
+        """
+        if not self.finalize_at_end:
+            return
+        await workflow.execute_activity(
+            finalize_order_state_activity,
+            args=[order_id, state],
+            **ACTIVITY_OPTS,
+        )
+
+    async def _ship(self, order_id: str, order: Order, write_state: bool) -> str:
+        """Run ShippingWorkflow once; the server retries it per SHIPPING_RETRY_POLICY."""
+        try:
+            return await workflow.execute_child_workflow(
+                ShippingWorkflow.run,
+                args=[order, write_state],
+                id=f"{order_id}-shipping",
+                task_queue=SHIPPING_TASK_QUEUE,  # Separate task queue for shipping
+                retry_policy=SHIPPING_RETRY_POLICY,
+                # One stable id per order: a re-run (e.g. after a reset) may only
+                # reuse it if the earlier shipping run failed, never start a second
+                # shipment for an order that already shipped
+                id_reuse_policy=WorkflowIDReusePolicy.ALLOW_DUPLICATE_FAILED_ONLY,
+            )
+        except ChildWorkflowError as e:
+            self.state = State.SHIPPING_FAILED
+            workflow.logger.error(
+                "OrderWorkflow: ShippingWorkflow failed after %s attempts: %s",
+                SHIPPING_RETRY_POLICY.maximum_attempts,
+                e,
+                extra={"order_id": order_id},
+            )
+            raise
+
+    async def _ship_legacy(self, order_id: str, order: Order, write_state: bool) -> str:
+        """Workflow-side retry loop, kept for histories recorded before _ship.
+
+        Fixed at the values those runs used, independent of SHIPPING_RETRY_POLICY.
+        """
+        max_attempts = 3
+        for attempt in range(max_attempts):
+            try:
+                return await workflow.execute_child_workflow(
+                    ShippingWorkflow.run,
+                    args=[order, write_state],
+                    id=f"{order_id}-shipping-{attempt}",
+                    task_queue=SHIPPING_TASK_QUEUE,
+                )
+            except ChildWorkflowError as e:
+                self.last_error = f"Shipping attempt {attempt + 1} failed: {str(e)}"
+                workflow.logger.error(
+                    "OrderWorkflow: ShippingWorkflow failed on attempt %s: %s",
+                    attempt + 1,
+                    e,
+                    extra={"order_id": order_id, "attempt": attempt + 1},
+                )
+                if attempt < max_attempts - 1:
+                    await workflow.sleep(timedelta(seconds=2))
+                else:
+                    self.state = State.SHIPPING_FAILED
+                    raise Exception(f"Shipping failed after {max_attempts} attempts: {str(e)}")
+
     @workflow.run
     async def run(
         self,
@@ -121,11 +272,10 @@ class OrderWorkflow:
         customer_name: str,
         order_total: float = 0.0,
         priority: str = "NORMAL",
+        create_customer: bool = False,
     ) -> str:
-        workflow.logger.info(
-            f"OrderWorkflow: Started for order_id={order_id}, payment_id={payment_id}, "
-            f"customer_id={customer_id}, customer_name={customer_name}"
-        )
+        self.finalize_at_end = workflow.patched("finalize-state")
+        write_state = not self.finalize_at_end
 
         # Set search attributes for workflow discoverability
         workflow.upsert_search_attributes(
@@ -139,112 +289,115 @@ class OrderWorkflow:
 
         try:
             # Step 1: receive
-            self.state = "RECEIVING"
-            workflow.logger.info(f"OrderWorkflow: State transition to RECEIVING")
+            self.state = State.RECEIVING
+            self._log_step(
+                order_id, payment_id=payment_id, customer_id=customer_id, customer_name=customer_name
+            )
+            # Demo orders (CLI) create their customer on the fly; API orders
+            # reference a customer that must already exist. Patched so runs
+            # started before this step existed still replay.
+            if create_customer and workflow.patched("ensure-customer"):
+                await workflow.execute_activity(
+                    ensure_customer_activity,
+                    args=[customer_id, customer_name],
+                    **ACTIVITY_OPTS,
+                )
             order = await workflow.execute_activity(
                 receive_order_activity,
                 args=[order_id, customer_id, order_total, priority],
-                **activity_opts(),
+                **ACTIVITY_OPTS,
             )
 
             if self.order_cancelled:
-                self.state = "CANCELLED"
-                workflow.logger.warning(f"OrderWorkflow: Cancelled after RECEIVING")
+                self.state = State.CANCELLED
+                workflow.logger.warning(
+                    "OrderWorkflow: Cancelled after RECEIVING", extra={"order_id": order_id}
+                )
+                await self._finalize_state(order_id, "CANCELLED")
                 return "CANCELLED"
 
             # Step 2: validate
-            self.state = "VALIDATING"
-            workflow.logger.info(f"OrderWorkflow: State transition to VALIDATING")
+            self.state = State.VALIDATING
+            self._log_step(order_id)
             await workflow.execute_activity(
                 validate_order_activity,
-                args=[order],
-                **activity_opts(),
+                args=[order, write_state],
+                **ACTIVITY_OPTS,
             )
 
             if self.order_cancelled:
-                self.state = "CANCELLED"
-                workflow.logger.warning(f"OrderWorkflow: Cancelled after VALIDATING")
+                self.state = State.CANCELLED
+                workflow.logger.warning(
+                    "OrderWorkflow: Cancelled after VALIDATING", extra={"order_id": order_id}
+                )
+                await self._finalize_state(order_id, "CANCELLED")
                 return "CANCELLED"
 
             # Step 2.5: Manual review timer - wait for approval signal
-            self.state = "AWAITING_MANUAL_APPROVAL"
-            workflow.logger.info(f"OrderWorkflow: State transition to AWAITING_MANUAL_APPROVAL - waiting for approve_order signal")
+            self.state = State.AWAITING_MANUAL_APPROVAL
+            self._log_step(order_id, waiting_for="approve_order")
 
-            # Wait for either approval or cancellation
+            # Wait for either approval or cancellation. wait_condition is the
+            # deterministic primitive here (asyncio.wait is not), and the SDK
+            # re-checks the predicate once per activation, not per event
             await workflow.wait_condition(
                 lambda: self.manual_review_approved or self.order_cancelled,
-                timeout=timedelta(seconds=30)  # 30 second timeout for manual approval
+                timeout=MANUAL_APPROVAL_TIMEOUT,
             )
 
             if self.order_cancelled:
-                self.state = "CANCELLED"
-                workflow.logger.warning(f"OrderWorkflow: Cancelled during manual review")
+                self.state = State.CANCELLED
+                workflow.logger.warning(
+                    "OrderWorkflow: Cancelled during manual review", extra={"order_id": order_id}
+                )
+                await self._finalize_state(order_id, "CANCELLED")
                 return "CANCELLED"
 
-            workflow.logger.info(f"OrderWorkflow: Manual review approved, proceeding to payment")
-
             # If address was updated, merge it into order
             if self.updated_address:
-                order["address"] = self.updated_address
-                workflow.logger.info(f"OrderWorkflow: Updated address applied to order")
+                order.address = self.updated_address
 
             # Step 3: charge payment
-            self.state = "CHARGING_PAYMENT"
-            workflow.logger.info(f"OrderWorkflow: State transition to CHARGING_PAYMENT")
+            self.state = State.CHARGING_PAYMENT
+            self._log_step(order_id, approved=True, address_updated=order.address is not None)
             await workflow.execute_activity(
                 charge_payment_activity,
                 args=[order, payment_id],
-                **activity_opts(),
-            )
-
-            # After payment, we cannot cancel (too late - money charged)
-            workflow.logger.info(f"OrderWorkflow: Payment charged successfully, order can no longer be cancelled")
-
-            # Step 4: shipping as child workflow with retry logic
-            self.state = "SHIPPING"
-            workflow.logger.info(f"OrderWorkflow: State transition to SHIPPING - starting child workflow")
-
-            max_shipping_retries = 3
-            shipping_result = None
-
-            for attempt in range(max_shipping_retries):
-                try:
-                    workflow.logger.info(f"OrderWorkflow: Attempting ShippingWorkflow (attempt {attempt + 1}/{max_shipping_retries})")
-                    shipping_result = await workflow.execute_child_workflow(
-                        ShippingWorkflow.run,
-                        args=[order],
-                        id=f"{order_id}-shipping-{attempt}",
-                        task_queue="shipping-tq",  # Separate task queue for shipping
-                    )
-                    workflow.logger.info(f"OrderWorkflow: ShippingWorkflow completed successfully")
-                    break  # Success, exit retry loop
-                except ChildWorkflowError as e:
-                    self.last_error = f"Shipping attempt {attempt + 1} failed: {str(e)}"
-                    workflow.logger.error(f"OrderWorkflow: ShippingWorkflow failed on attempt {attempt + 1}: {e}")
-
-                    if attempt < max_shipping_retries - 1:
-                        workflow.logger.info(f"OrderWorkflow: Retrying ShippingWorkflow...")
-                        await workflow.sleep(timedelta(seconds=2))  # Wait before retry
-                    else:
-                        workflow.logger.error(f"OrderWorkflow: ShippingWorkflow failed after {max_shipping_retries} attempts")
-                        self.state = "SHIPPING_FAILED"
-                        raise Exception(f"Shipping failed after {max_shipping_retries} attempts: {str(e)}")
-
-            # Step 5: mark order shipped in DB
-            self.state = "MARKING_SHIPPED"
-            workflow.logger.info(f"OrderWorkflow: State transition to MARKING_SHIPPED")
+                **ACTIVITY_OPTS,
+            )
+
+            # Step 4: shipping as child workflow, retried by the server per SHIPPING_RETRY_POLICY.
+            # From here on the order can't be cancelled (too late - money charged)
+            self.state = State.SHIPPING
+            self._log_step(order_id, payment_charged=True)
+
+            if workflow.patched("shipping-retry-policy"):
+                shipping_result = await self._ship(order_id, order, write_state)
+            else:
+                # Runs started before the retry policy: keep their recorded
+                # per-attempt child ids and the timer between attempts
+                shipping_result = await self._ship_legacy(order_id, order, write_state)
+
+            # Step 5: mark order shipped in DB (event, then the one final state write)
+            self.state = State.MARKING_SHIPPED
+            self._log_step(order_id, shipping_result=shipping_result)
             await workflow.execute_activity(
                 mark_order_shipped_activity,
-                args=[order],
-                **activity_opts(),
+                args=[order, write_state],
+                **ACTIVITY_OPTS,
             )
+            await self._finalize_state(order_id, "SHIPPED")
 
-            self.state = "COMPLETED"
-            workflow.logger.info(f"OrderWorkflow: Successfully completed for order {order_id}")
+            self.state = State.COMPLETED
+            self._log_step(order_id)
             return shipping_result
 
         except Exception as e:
             self.last_error = str(e)
-            workflow.logger.error(f"OrderWorkflow: Failed with error: {e}")
+            workflow.logger.error(
+                "OrderWorkflow: Failed with error: %s",
+                e,
+                extra={"order_id": order_id, "state": self.state.name},
+            )
             raise
 
@@ -0,0 +1,40 @@
+"""
+Shared pytest fixtures
+"""
+
+from unittest.mock import AsyncMock
+
+import pytest
+
+
+class _HandleSpec:
+    """The slice of temporalio's WorkflowHandle the API touches.
+
+    Speccing mocks on this small class means AsyncMock only builds the
+    attributes listed here instead of probing a full handle. The methods are
+    async so their child mocks come out as AsyncMocks (awaitable).
+    """
+
+    id: str = ""
+    result_run_id: str = ""
+
+    async def signal(self, *args, **kwargs): ...
+
+    async def query(self, *args, **kwargs): ...
+
+    async def result(self, *args, **kwargs): ...
+
+    async def describe(self, *args, **kwargs): ...
+
+
+@pytest.fixture
+def make_handle():
+    """Factory for mock workflow handles: make_handle(id=..., result_run_id=...)"""
+
+    def _make_handle(id: str = "test-order-123", result_run_id: str = "run-123") -> AsyncMock:
+        handle = AsyncMock(spec=_HandleSpec)
+        handle.id = id
+        handle.result_run_id = result_run_id
+        return handle
+
+    return _make_handle
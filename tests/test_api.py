@@ -2,57 +2,88 @@
 Integration tests for FastAPI endpoints
 """
 
+from contextlib import asynccontextmanager
+from types import MappingProxyType, SimpleNamespace
+
+import httpx
+import orjson
 import pytest
-from fastapi.testclient import TestClient
-from unittest.mock import AsyncMock, MagicMock, patch
-import asyncio
+import pytest_asyncio
+from fastapi import HTTPException
+from unittest.mock import AsyncMock, MagicMock
 
+import api.server
 from api.server import app
 
+# Read-only so parametrized cases can't mutate it; copied into each payload
+_NY_ADDRESS = MappingProxyType({
+    "street": "123 Main St",
+    "city": "New York",
+    "state": "NY",
+    "zip_code": "10001",
+    "country": "USA",
+})
 
-@pytest.fixture
-def client():
-    """Create a test client"""
-    return TestClient(app)
+
+# The shared client lives on the session's event loop, so the tests run there
+# too (asyncio_mode = auto in pytest.ini collects them without markers)
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+@pytest_asyncio.fixture(scope="module", loop_scope="session")
+async def client():
+    """Create an async test client, shared by the module's tests.
+
+    Requests go straight to the app through ASGITransport on the test's event
+    loop (no thread hop per request, unlike TestClient). ASGITransport doesn't
+    run the lifespan, which would connect to a real Temporal server; tests set
+    api.server.temporal_client themselves.
+    """
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
 
 
 @pytest.fixture
-def mock_temporal_client():
-    """Mock Temporal client for testing"""
+def mock_temporal(monkeypatch, make_handle):
+    """Patch api.server.temporal_client with a mock client (restored afterwards).
+
+    The client hands out one shared mock handle, also reachable as
+    `mock_temporal.handle`, so tests only set the return values they need.
+    """
+    handle = make_handle()
+
     mock_client = AsyncMock()
-    return mock_client
+    mock_client.handle = handle
+    mock_client.get_workflow_handle = MagicMock(return_value=handle)
+    mock_client.start_workflow = AsyncMock(return_value=handle)
+
+    monkeypatch.setattr(api.server, "temporal_client", mock_client)
+    yield mock_client
 
 
 class TestAPIEndpoints:
     """Tests for API endpoints"""
 
-    def test_root_endpoint(self, client):
+    async def test_root_endpoint(self, client):
         """Test root endpoint returns health check"""
-        response = client.get("/")
+        response = await client.get("/")
         assert response.status_code == 200
         data = response.json()
         assert data["service"] == "Order Orchestration API"
         assert data["status"] == "running"
 
-    @patch('api.server.temporal_client')
-    def test_start_order_endpoint(self, mock_client_global, client):
+    async def test_start_order_endpoint(self, client, mock_temporal):
         """Test starting a new order"""
-        # Setup mock
-        mock_handle = AsyncMock()
-        mock_handle.id = "test-order-123"
-        mock_handle.result_run_id = "run-123"
-
-        mock_client = AsyncMock()
-        mock_client.start_workflow = AsyncMock(return_value=mock_handle)
-
-        # Patch the global client
-        import api.server
-        api.server.temporal_client = mock_client
-
         # Make request
-        response = client.post(
+        response = await client.post(
             "/orders/test-order-123/start",
-            json={"payment_id": "test-payment-123"}
+            json={
+                "customer_id": "cust-123",
+                # Given, so the endpoint doesn't look the customer up in the DB
+                "customer_name": "Test Customer",
+                "payment_id": "test-payment-123",
+            },
         )
 
         # Verify
@@ -60,159 +91,206 @@ class TestAPIEndpoints:
         data = response.json()
         assert data["order_id"] == "test-order-123"
         assert data["payment_id"] == "test-payment-123"
+        assert data["customer_id"] == "cust-123"
         assert data["workflow_id"] == "test-order-123"
         assert "started successfully" in data["message"].lower()
 
-    @patch('api.server.temporal_client')
-    def test_cancel_order_endpoint(self, mock_client_global, client):
-        """Test cancelling an order"""
-        # Setup mock
-        mock_handle = AsyncMock()
-        mock_handle.signal = AsyncMock()
-
-        mock_client = AsyncMock()
-        mock_client.get_workflow_handle = MagicMock(return_value=mock_handle)
-
-        # Patch the global client
-        import api.server
-        api.server.temporal_client = mock_client
-
+    @pytest.mark.parametrize(
+        "path, signal_name, payload",
+        [
+            ("signals/cancel", "cancel_order", None),
+            ("signals/approve", "approve_order", None),
+            ("signals/update-address", "update_address", dict(_NY_ADDRESS)),
+        ],
+    )
+    async def test_signal_endpoint(self, client, mock_temporal, path, signal_name, payload):
+        """Test the cancel / approve / update-address signal endpoints"""
         # Make request
-        response = client.post("/orders/test-order-123/signals/cancel")
+        response = await client.post(f"/orders/test-order-123/{path}", json=payload)
 
         # Verify
         assert response.status_code == 200
         data = response.json()
         assert data["order_id"] == "test-order-123"
-        assert data["signal"] == "cancel_order"
+        assert data["signal"] == signal_name
         assert data["status"] == "sent"
+        if payload is not None:
+            assert data["address"] == payload
+        mock_temporal.handle.signal.assert_awaited_once()
 
-    @patch('api.server.temporal_client')
-    def test_update_address_endpoint(self, mock_client_global, client):
-        """Test updating shipping address"""
-        # Setup mock
-        mock_handle = AsyncMock()
-        mock_handle.signal = AsyncMock()
-
-        mock_client = AsyncMock()
-        mock_client.get_workflow_handle = MagicMock(return_value=mock_handle)
-
-        # Patch the global client
-        import api.server
-        api.server.temporal_client = mock_client
+    async def test_get_status_endpoint(self, client, mock_temporal):
+        """Test getting order status"""
+        mock_temporal.handle.query.return_value = {
+            "state": "AWAITING_MANUAL_APPROVAL",
+            "cancelled": False,
+            "manual_review_approved": False,
+            "last_error": None
+        }
+        mock_description = MagicMock()
+        mock_description.status.name = "RUNNING"
+        mock_temporal.handle.describe.return_value = mock_description
 
         # Make request
-        address = {
-            "street": "123 Main St",
-            "city": "New York",
-            "state": "NY",
-            "zip_code": "10001",
-            "country": "USA"
-        }
-        response = client.post(
-            "/orders/test-order-123/signals/update-address",
-            json=address
-        )
+        response = await client.get("/orders/test-order-123/status")
 
         # Verify
         assert response.status_code == 200
         data = response.json()
         assert data["order_id"] == "test-order-123"
-        assert data["signal"] == "update_address"
-        assert data["status"] == "sent"
-        assert data["address"]["street"] == "123 Main St"
-
-    @patch('api.server.temporal_client')
-    def test_approve_order_endpoint(self, mock_client_global, client):
-        """Test approving an order"""
-        # Setup mock
-        mock_handle = AsyncMock()
-        mock_handle.signal = AsyncMock()
-
-        mock_client = AsyncMock()
-        mock_client.get_workflow_handle = MagicMock(return_value=mock_handle)
+        assert data["workflow_state"] == "AWAITING_MANUAL_APPROVAL"
+        assert data["is_running"] is True
 
-        # Patch the global client
-        import api.server
-        api.server.temporal_client = mock_client
+    async def test_get_result_endpoint(self, client, mock_temporal):
+        """Test getting workflow result"""
+        mock_temporal.handle.result.return_value = "DISPATCHED"
 
         # Make request
-        response = client.post("/orders/test-order-123/signals/approve")
+        response = await client.get("/orders/test-order-123/result")
 
         # Verify
         assert response.status_code == 200
         data = response.json()
         assert data["order_id"] == "test-order-123"
-        assert data["signal"] == "approve_order"
-        assert data["status"] == "sent"
-
-    @patch('api.server.temporal_client')
-    def test_get_status_endpoint(self, mock_client_global, client):
-        """Test getting order status"""
-        # Setup mock
-        mock_handle = AsyncMock()
-        mock_handle.query = AsyncMock(return_value={
-            "state": "AWAITING_MANUAL_APPROVAL",
-            "cancelled": False,
-            "manual_review_approved": False,
-            "last_error": None
-        })
+        assert data["result"] == "DISPATCHED"
 
-        mock_description = MagicMock()
-        mock_description.status.name = "RUNNING"
-        mock_handle.describe = AsyncMock(return_value=mock_description)
+    async def test_quote_query_value_escapes_quotes_and_backslashes(self):
+        """User input can't close the quoted literal in a Temporal list filter"""
+        assert api.server.quote_query_value('a\\" OR "x"="x') == 'a\\\\\\" OR \\"x\\"=\\"x'
 
-        mock_client = AsyncMock()
-        mock_client.get_workflow_handle = MagicMock(return_value=mock_handle)
+    async def test_list_workflows_escapes_filter_values(self, client, mock_temporal):
+        """The customer_name filter reaches list_workflows escaped"""
+        async def no_workflows():
+            return
+            yield
 
-        # Patch the global client
-        import api.server
-        api.server.temporal_client = mock_client
+        mock_temporal.list_workflows = MagicMock(return_value=no_workflows())
 
         # Make request
-        response = client.get("/orders/test-order-123/status")
+        response = await client.get("/orders", params={"customer_name": 'Bob\\" OR "1"="1'})
 
         # Verify
         assert response.status_code == 200
-        data = response.json()
-        assert data["order_id"] == "test-order-123"
-        assert data["workflow_state"] == "AWAITING_MANUAL_APPROVAL"
-        assert data["is_running"] is True
+        query = mock_temporal.list_workflows.call_args.kwargs["query"]
+        assert query == 'CustomerName = "Bob\\\\\\" OR \\"1\\"=\\"1"'
+        assert response.json()["query"] == query
 
-    @patch('api.server.temporal_client')
-    def test_get_result_endpoint(self, mock_client_global, client):
-        """Test getting workflow result"""
-        # Setup mock
-        mock_handle = AsyncMock()
-        mock_handle.result = AsyncMock(return_value="DISPATCHED")
+    async def test_list_customers_ndjson(self, client, monkeypatch):
+        """format=ndjson streams one JSON object per line"""
+        rows = [
+            SimpleNamespace(id="cust-1", name="Ada", email="ada@example.com", phone=None, created_at="2024-01-02"),
+            SimpleNamespace(id="cust-2", name="Bob", email="bob@example.com", phone="555", created_at="2024-01-01"),
+        ]
 
-        mock_client = AsyncMock()
-        mock_client.get_workflow_handle = MagicMock(return_value=mock_handle)
+        async def stream_rows():
+            for row in rows:
+                yield row
 
-        # Patch the global client
-        import api.server
-        api.server.temporal_client = mock_client
+        class FakeSession:
+            async def stream(self, statement):
+                return stream_rows()
+
+        @asynccontextmanager
+        async def fake_session_local():
+            yield FakeSession()
+
+        monkeypatch.setattr(api.server, "AsyncSessionLocal", fake_session_local)
 
         # Make request
-        response = client.get("/orders/test-order-123/result")
+        response = await client.get("/customers", params={"format": "ndjson"})
 
         # Verify
         assert response.status_code == 200
-        data = response.json()
-        assert data["order_id"] == "test-order-123"
-        assert data["result"] == "DISPATCHED"
-
-    def test_workflow_not_found(self, client):
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert [orjson.loads(line) for line in response.text.splitlines()] == [
+            {"id": "cust-1", "name": "Ada", "email": "ada@example.com", "phone": None, "created_at": "2024-01-02"},
+            {"id": "cust-2", "name": "Bob", "email": "bob@example.com", "phone": "555", "created_at": "2024-01-01"},
+        ]
+
+    async def test_list_customers_rejects_unknown_format(self, client):
+        """An unsupported format is a validation error, not a silent JSON fallback"""
+        response = await client.get("/customers", params={"format": "csv"})
+        assert response.status_code == 422
+
+    async def test_workflow_not_found(self, client, monkeypatch):
         """Test handling of workflow not found"""
         # Mock temporal client not initialized
-        import api.server
-        api.server.temporal_client = None
+        monkeypatch.setattr(api.server, "temporal_client", None)
 
         # Make request
-        response = client.post("/orders/nonexistent/signals/cancel")
+        response = await client.post("/orders/nonexistent/signals/cancel")
 
         # Should return error
-        assert response.status_code == 500
+        assert response.status_code == 503
+
+    async def test_temporal_client_dependency_unavailable(self, monkeypatch):
+        """The client dependency itself rejects requests before Temporal is connected"""
+        monkeypatch.setattr(api.server, "temporal_client", None)
+
+        with pytest.raises(HTTPException) as exc_info:
+            await api.server.get_temporal_client()
+        assert exc_info.value.status_code == 503
+
+
+@pytest.fixture
+def customer_lookup(monkeypatch):
+    """Give get_customer_name an empty cache, a fake DB lookup and a settable clock.
+
+    Returns (fetched customer_ids, clock); set clock[0] to move time.
+    """
+    names = {"cust-a": "Ada", "cust-b": "Bob", "cust-c": "Cy"}
+    fetched = []
+    clock = [1000.0]
+
+    async def fake_fetch(customer_id):
+        fetched.append(customer_id)
+        return names.get(customer_id)
+
+    monkeypatch.setattr(api.server, "_fetch_customer_name", fake_fetch)
+    monkeypatch.setattr(api.server, "_customer_name_cache", {})
+    monkeypatch.setattr(api.server, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    return fetched, clock
+
+
+class TestCustomerNameCache:
+    """Tests for the TTL cache behind get_customer_name"""
+
+    async def test_hit_skips_the_db(self, customer_lookup):
+        fetched, _ = customer_lookup
+
+        assert await api.server.get_customer_name("cust-a") == "Ada"
+        assert await api.server.get_customer_name("cust-a") == "Ada"
+
+        assert fetched == ["cust-a"]
+
+    async def test_missing_customer_is_not_cached(self, customer_lookup):
+        fetched, _ = customer_lookup
+
+        assert await api.server.get_customer_name("cust-x") is None
+        assert await api.server.get_customer_name("cust-x") is None
+
+        assert fetched == ["cust-x", "cust-x"]
+
+    async def test_entry_expires_after_ttl(self, customer_lookup):
+        fetched, clock = customer_lookup
+
+        await api.server.get_customer_name("cust-a")
+        clock[0] += api.server.CUSTOMER_NAME_CACHE_TTL - 1
+        await api.server.get_customer_name("cust-a")
+        clock[0] += 1
+        await api.server.get_customer_name("cust-a")
+
+        assert fetched == ["cust-a", "cust-a"]
+
+    async def test_oldest_entry_evicted_at_capacity(self, customer_lookup, monkeypatch):
+        fetched, _ = customer_lookup
+        monkeypatch.setattr(api.server, "CUSTOMER_NAME_CACHE_MAXSIZE", 2)
+
+        for customer_id in ("cust-a", "cust-b", "cust-c"):
+            await api.server.get_customer_name(customer_id)
+
+        assert list(api.server._customer_name_cache) == ["cust-b", "cust-c"]
+        await api.server.get_customer_name("cust-a")
+        assert fetched == ["cust-a", "cust-b", "cust-c", "cust-a"]
 
 
 if __name__ == "__main__":
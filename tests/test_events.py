@@ -0,0 +1,121 @@
+"""
+Unit tests for the event batcher (temporal_app/events.py), against a fake pool
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import orjson
+import pytest
+
+from temporal_app import events
+from temporal_app.events import EVENT_COLUMNS, EventBatcher
+
+
+class FakeConnection:
+    """Records each copy_records_to_table call, or raises `error` if set"""
+
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.copies = []
+
+    async def copy_records_to_table(self, table, *, records, columns):
+        if self.error is not None:
+            raise self.error
+        self.copies.append((table, list(records), columns))
+
+
+class FakePool:
+    def __init__(self, conn: FakeConnection):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+@pytest.fixture
+def fake_conn(monkeypatch):
+    """Route the batcher's get_pool() to a fake pool; returns its connection"""
+    conn = FakeConnection()
+    pool = FakePool(conn)
+
+    async def get_pool():
+        return pool
+
+    monkeypatch.setattr(events, "get_pool", get_pool)
+    return conn
+
+
+class TestEventBatcher:
+    """Tests for EventBatcher"""
+
+    async def test_concurrent_puts_share_one_copy(self, fake_conn):
+        """Rows put while a batch is forming are written with a single COPY"""
+        batcher = EventBatcher()
+
+        await asyncio.gather(
+            batcher.put("o-1", "ORDER_RECEIVED", {"n": 1}),
+            batcher.put("o-2", "ORDER_VALIDATED", {"n": 2}),
+            batcher.put("o-3", "PAYMENT_CHARGED", {"n": 3}),
+        )
+        await batcher.close()
+
+        assert fake_conn.copies == [
+            (
+                "events",
+                [
+                    ("o-1", "ORDER_RECEIVED", orjson.dumps({"n": 1}).decode()),
+                    ("o-2", "ORDER_VALIDATED", orjson.dumps({"n": 2}).decode()),
+                    ("o-3", "PAYMENT_CHARGED", orjson.dumps({"n": 3}).decode()),
+                ],
+                EVENT_COLUMNS,
+            )
+        ]
+
+    async def test_flush_error_reaches_every_caller(self, fake_conn):
+        """A failed COPY is raised from each put() whose row was in the batch"""
+        fake_conn.error = RuntimeError("copy failed")
+        batcher = EventBatcher()
+
+        results = await asyncio.gather(
+            batcher.put("o-1", "ORDER_RECEIVED", {}),
+            batcher.put("o-2", "ORDER_RECEIVED", {}),
+            return_exceptions=True,
+        )
+        await batcher.close()
+
+        assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+        assert all(str(result) == "copy failed" for result in results)
+
+    async def test_close_drains_queued_rows(self, fake_conn):
+        """close() writes the rows already queued before stopping the flusher"""
+        batcher = EventBatcher()
+        puts = [
+            asyncio.create_task(batcher.put(f"o-{i}", "ORDER_RECEIVED", {}))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0)  # let the puts enqueue their rows
+
+        await batcher.close()
+
+        assert all(put.done() and put.exception() is None for put in puts)
+        assert [row[0] for _, rows, _ in fake_conn.copies for row in rows] == ["o-0", "o-1", "o-2"]
+        assert batcher._task is None
+
+    async def test_put_restarts_a_dead_flusher(self, fake_conn):
+        """A flusher that died doesn't leave later puts waiting forever"""
+        batcher = EventBatcher()
+        batcher.start()
+        batcher._task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await batcher._task
+
+        await asyncio.wait_for(batcher.put("o-1", "ORDER_RECEIVED", {}), timeout=1)
+        await batcher.close()
+
+        assert [row[0] for _, rows, _ in fake_conn.copies for row in rows] == ["o-1"]
+
+    async def test_one_batcher_per_event_loop(self):
+        """get_batcher() hands out the same batcher within one event loop"""
+        assert events.get_batcher() is events.get_batcher()
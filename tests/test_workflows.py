@@ -2,7 +2,12 @@
 Unit tests for workflows using Temporal's testing framework
 """
 
+import asyncio
+import itertools
+from types import MappingProxyType
+
 import pytest
+import pytest_asyncio
 from datetime import timedelta
 from temporalio.testing import WorkflowEnvironment
 from temporalio.worker import Worker
@@ -11,78 +16,154 @@ from temporalio.client import WorkflowFailureError as ClientWorkflowFailureError
 
 from temporal_app.workflows import OrderWorkflow, ShippingWorkflow
 from temporal_app.activities import (
+    ensure_customer_activity,
     receive_order_activity,
     validate_order_activity,
     charge_payment_activity,
     mark_order_shipped_activity,
+    finalize_order_state_activity,
     prepare_package_activity,
     dispatch_carrier_activity,
 )
 
 
-@pytest.fixture
+# The time-skipping test server and the workers are started once per session
+# and shared by every test (each test uses its own order_id), so the tests run
+# on the session's event loop as well. asyncio_mode = auto (pytest.ini) picks
+# up the async tests without per-test markers.
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+# Read-only so a test can't mutate an address another test reuses; pass
+# dict(...) where it has to be serialized (signal payloads)
+_BOSTON_ADDRESS = MappingProxyType({
+    "street": "456 New St",
+    "city": "Boston",
+    "state": "MA",
+    "zip_code": "02101",
+    "country": "USA",
+})
+_SEATTLE_ADDRESS = MappingProxyType({
+    "street": "789 Test Ave",
+    "city": "Seattle",
+    "state": "WA",
+    "zip_code": "98101",
+    "country": "USA",
+})
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
 async def workflow_env():
     """Create a test workflow environment"""
     async with await WorkflowEnvironment.start_time_skipping() as env:
         yield env
 
 
+@pytest.fixture(scope="session")
+def task_queue(worker_id):
+    """Order task queue for this pytest-xdist worker ("master" when not distributed).
+
+    Each xdist worker process starts its own test server, so only the queue the
+    tests start workflows on is made unique; the workflow itself dispatches
+    shipping children to the fixed shipping-tq.
+    """
+    return f"order-tq-{worker_id}"
+
+
+# Workflow ids share the session's test server, so every test draws a fresh one
+_order_ids = itertools.count(1)
+
+
 @pytest.fixture
-async def worker(workflow_env):
+def order_id():
+    """A workflow/order id no other test in this session uses"""
+    return f"o-{next(_order_ids)}"
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def shipping_worker(workflow_env):
+    """Run only the shipping worker (ShippingWorkflow and its activities)"""
+    shipping_worker = Worker(
+        workflow_env.client,
+        task_queue="shipping-tq",
+        workflows=[ShippingWorkflow],
+        activities=[
+            prepare_package_activity,
+            dispatch_carrier_activity,
+        ],
+    )
+    async with shipping_worker:
+        yield shipping_worker
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def worker(workflow_env, shipping_worker, task_queue):
     """Create a test worker with all workflows and activities"""
-    # Create workers for both task queues
+    # OrderWorkflow dispatches its shipping child to the shipping worker above
     order_worker = Worker(
         workflow_env.client,
-        task_queue="order-tq",
+        task_queue=task_queue,
         workflows=[OrderWorkflow],
         activities=[
+            ensure_customer_activity,
             receive_order_activity,
             validate_order_activity,
             charge_payment_activity,
             mark_order_shipped_activity,
+            finalize_order_state_activity,
         ],
     )
 
-    shipping_worker = Worker(
-        workflow_env.client,
-        task_queue="shipping-tq",
-        workflows=[ShippingWorkflow],
-        activities=[
-            prepare_package_activity,
-            dispatch_carrier_activity,
-        ],
-    )
-
-    # Run both workers
-    async with order_worker, shipping_worker:
+    async with order_worker:
         yield order_worker
 
 
+async def wait_for_state(handle, target, timeout: float = 5.0) -> dict:
+    """Poll the status query until the state is `target` (a name or a tuple of names).
+
+    Returns the matching status; raises TimeoutError if it isn't reached in time.
+    """
+    targets = (target,) if isinstance(target, str) else target
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        status = await handle.query(OrderWorkflow.status)
+        if status["state"] in targets:
+            return status
+        if asyncio.get_running_loop().time() >= deadline:
+            raise TimeoutError(f"state {status['state']!r} never reached {targets} within {timeout}s")
+        await asyncio.sleep(0.05)
+
+
+def order_args(order_id: str) -> list:
+    """OrderWorkflow.run arguments for a test order (create_customer=True, so the
+    workflow inserts the order's customer first)"""
+    return [order_id, f"{order_id}-payment", f"{order_id}-cust", "Test Customer", 100.0, "NORMAL", True]
+
+
+def assert_status(actual: dict, **expected) -> None:
+    """Assert that the status has the expected value for each given key."""
+    assert {key: actual[key] for key in expected} == expected
+
+
 class TestOrderWorkflow:
     """Tests for OrderWorkflow"""
 
-    @pytest.mark.asyncio
-    async def test_successful_order_flow_with_approval(self, workflow_env, worker):
+    async def test_successful_order_flow_with_approval(self, workflow_env, worker, task_queue, order_id):
         """Test successful order flow with manual approval"""
-        order_id = "test-order-001"
-        payment_id = "test-payment-001"
-
         # Start the workflow
         handle = await workflow_env.client.start_workflow(
             OrderWorkflow.run,
-            args=[order_id, payment_id],
+            args=order_args(order_id),
             id=order_id,
-            task_queue="order-tq",
+            task_queue=task_queue,
             run_timeout=timedelta(seconds=15),
         )
 
         # Wait for workflow to reach manual approval state
-        await workflow_env.sleep(1)
+        await wait_for_state(handle, "AWAITING_MANUAL_APPROVAL")
 
         # Check status - should be waiting for approval
         status = await handle.query(OrderWorkflow.status)
-        assert status["state"] == "AWAITING_MANUAL_APPROVAL"
-        assert not status["manual_review_approved"]
+        assert_status(status, state="AWAITING_MANUAL_APPROVAL", manual_review_approved=False)
 
         # Send approval signal
         await handle.signal(OrderWorkflow.approve_order)
@@ -95,27 +176,21 @@ class TestOrderWorkflow:
 
         # Check final status
         final_status = await handle.query(OrderWorkflow.status)
-        assert final_status["state"] == "COMPLETED"
-        assert final_status["manual_review_approved"]
-        assert not final_status["cancelled"]
+        assert_status(final_status, state="COMPLETED", manual_review_approved=True, cancelled=False)
 
-    @pytest.mark.asyncio
-    async def test_order_cancellation_before_approval(self, workflow_env, worker):
+    async def test_order_cancellation_before_approval(self, workflow_env, worker, task_queue, order_id):
         """Test order cancellation before manual approval"""
-        order_id = "test-order-002"
-        payment_id = "test-payment-002"
-
         # Start the workflow
         handle = await workflow_env.client.start_workflow(
             OrderWorkflow.run,
-            args=[order_id, payment_id],
+            args=order_args(order_id),
             id=order_id,
-            task_queue="order-tq",
+            task_queue=task_queue,
             run_timeout=timedelta(seconds=15),
         )
 
         # Wait for workflow to reach manual approval state
-        await workflow_env.sleep(1)
+        await wait_for_state(handle, "AWAITING_MANUAL_APPROVAL")
 
         # Send cancellation signal
         await handle.signal(OrderWorkflow.cancel_order)
@@ -128,40 +203,28 @@ class TestOrderWorkflow:
 
         # Check final status
         final_status = await handle.query(OrderWorkflow.status)
-        assert final_status["state"] == "CANCELLED"
-        assert final_status["cancelled"]
+        assert_status(final_status, state="CANCELLED", cancelled=True)
 
-    @pytest.mark.asyncio
-    async def test_address_update_before_approval(self, workflow_env, worker):
+    async def test_address_update_before_approval(self, workflow_env, worker, task_queue, order_id):
         """Test address update before manual approval"""
-        order_id = "test-order-003"
-        payment_id = "test-payment-003"
-
         # Start the workflow
         handle = await workflow_env.client.start_workflow(
             OrderWorkflow.run,
-            args=[order_id, payment_id],
+            args=order_args(order_id),
             id=order_id,
-            task_queue="order-tq",
+            task_queue=task_queue,
             run_timeout=timedelta(seconds=15),
         )
 
         # Wait for workflow to reach manual approval state
-        await workflow_env.sleep(1)
+        await wait_for_state(handle, "AWAITING_MANUAL_APPROVAL")
 
         # Update address
-        new_address = {
-            "street": "456 New St",
-            "city": "Boston",
-            "state": "MA",
-            "zip_code": "02101",
-            "country": "USA"
-        }
-        await handle.signal(OrderWorkflow.update_address, new_address)
+        await handle.signal(OrderWorkflow.update_address, dict(_BOSTON_ADDRESS))
 
         # Check that address was updated
         status = await handle.query(OrderWorkflow.status)
-        assert status["updated_address"] == new_address
+        assert status["updated_address"] == _BOSTON_ADDRESS
 
         # Approve and complete
         await handle.signal(OrderWorkflow.approve_order)
@@ -169,31 +232,24 @@ class TestOrderWorkflow:
 
         assert result == "DISPATCHED"
 
-    @pytest.mark.asyncio
-    async def test_cannot_cancel_after_payment(self, workflow_env, worker):
+    async def test_cannot_cancel_after_payment(self, workflow_env, worker, task_queue, order_id):
         """Test that order cannot be cancelled after payment is charged"""
-        order_id = "test-order-004"
-        payment_id = "test-payment-004"
-
         # Start the workflow
         handle = await workflow_env.client.start_workflow(
             OrderWorkflow.run,
-            args=[order_id, payment_id],
+            args=order_args(order_id),
             id=order_id,
-            task_queue="order-tq",
+            task_queue=task_queue,
             run_timeout=timedelta(seconds=15),
         )
 
         # Wait and approve
-        await workflow_env.sleep(1)
+        await wait_for_state(handle, "AWAITING_MANUAL_APPROVAL")
         await handle.signal(OrderWorkflow.approve_order)
 
-        # Wait for payment to be charged
-        await workflow_env.sleep(2)
-
-        # Check state - should be past CHARGING_PAYMENT
-        status = await handle.query(OrderWorkflow.status)
-        assert status["state"] in ["SHIPPING", "MARKING_SHIPPED", "COMPLETED"]
+        # Wait until the order is no longer cancellable (NON_CANCELLABLE_MASK:
+        # from CHARGING_PAYMENT on)
+        await wait_for_state(handle, ("CHARGING_PAYMENT", "SHIPPING", "MARKING_SHIPPED", "COMPLETED"))
 
         # Try to cancel (should not work)
         await handle.signal(OrderWorkflow.cancel_order)
@@ -205,30 +261,26 @@ class TestOrderWorkflow:
         assert result == "DISPATCHED"
 
         final_status = await handle.query(OrderWorkflow.status)
-        assert final_status["state"] == "COMPLETED"
-        assert not final_status["cancelled"]  # Should NOT be cancelled
+        # Should complete, NOT be cancelled
+        assert_status(final_status, state="COMPLETED", cancelled=False)
 
-    @pytest.mark.asyncio
-    async def test_manual_approval_timeout(self, workflow_env, worker):
+    async def test_manual_approval_timeout(self, workflow_env, worker, task_queue, order_id):
         """Test that workflow times out if manual approval not received"""
-        order_id = "test-order-005"
-        payment_id = "test-payment-005"
-
         # Start the workflow
         handle = await workflow_env.client.start_workflow(
             OrderWorkflow.run,
-            args=[order_id, payment_id],
+            args=order_args(order_id),
             id=order_id,
-            task_queue="order-tq",
+            task_queue=task_queue,
             run_timeout=timedelta(seconds=15),
         )
 
         # Wait for workflow to reach manual approval state
-        await workflow_env.sleep(1)
+        await wait_for_state(handle, "AWAITING_MANUAL_APPROVAL")
 
         # Don't send approval - let it timeout
-        # Skip time to trigger the 30-second approval timeout
-        await workflow_env.sleep(31)
+        # One jump of the virtual clock past the 30-second approval timeout
+        await workflow_env.sleep(timedelta(seconds=35))
 
         # Workflow should timeout
         with pytest.raises((WorkflowFailureError, ClientWorkflowFailureError)):
@@ -238,11 +290,10 @@ class TestOrderWorkflow:
 class TestShippingWorkflow:
     """Tests for ShippingWorkflow"""
 
-    @pytest.mark.asyncio
-    async def test_successful_shipping(self, workflow_env, worker):
+    async def test_successful_shipping(self, workflow_env, shipping_worker, order_id):
         """Test successful shipping workflow"""
         order = {
-            "order_id": "test-order-shipping-001",
+            "order_id": order_id,
             "items": [{"sku": "ABC", "qty": 1}]
         }
 
@@ -262,91 +313,61 @@ class TestShippingWorkflow:
 
         # Check final status
         status = await handle.query(ShippingWorkflow.status)
-        assert status["state"] == "DONE"
-        assert status["last_error"] is None
+        assert_status(status, state="DONE", last_error=None)
 
 
 class TestIntegration:
     """Integration tests for the full order flow"""
 
-    @pytest.mark.asyncio
-    async def test_complete_order_lifecycle(self, workflow_env, worker):
+    async def test_complete_order_lifecycle(self, workflow_env, worker, task_queue, order_id):
         """Test complete order lifecycle from start to finish"""
-        order_id = "test-integration-001"
-        payment_id = "test-integration-payment-001"
-
         # Start the workflow
         handle = await workflow_env.client.start_workflow(
             OrderWorkflow.run,
-            args=[order_id, payment_id],
+            args=order_args(order_id),
             id=order_id,
-            task_queue="order-tq",
+            task_queue=task_queue,
             run_timeout=timedelta(seconds=15),
         )
 
-        # Wait and check status at each stage
-        await workflow_env.sleep(0.5)
-        status1 = await handle.query(OrderWorkflow.status)
-        assert status1["state"] in ["RECEIVING", "VALIDATING", "AWAITING_MANUAL_APPROVAL"]
-
-        # Wait for manual approval state
-        await workflow_env.sleep(1)
-        status2 = await handle.query(OrderWorkflow.status)
-        assert status2["state"] == "AWAITING_MANUAL_APPROVAL"
+        # Wait for manual approval state (receiving/validating precede it)
+        await wait_for_state(handle, "AWAITING_MANUAL_APPROVAL")
 
         # Approve
         await handle.signal(OrderWorkflow.approve_order)
 
-        # Wait for payment
-        await workflow_env.sleep(1)
-        status3 = await handle.query(OrderWorkflow.status)
-        assert status3["state"] in ["CHARGING_PAYMENT", "SHIPPING", "MARKING_SHIPPED", "COMPLETED"]
-
-        # Wait for completion
+        # Wait for completion; the result only arrives after payment and shipping
         result = await handle.result()
 
         # Verify
         assert result == "DISPATCHED"
 
         final_status = await handle.query(OrderWorkflow.status)
-        assert final_status["state"] == "COMPLETED"
-        assert final_status["manual_review_approved"]
-        assert not final_status["cancelled"]
+        assert_status(final_status, state="COMPLETED", manual_review_approved=True, cancelled=False)
 
-    @pytest.mark.asyncio
-    async def test_order_with_address_update_and_approval(self, workflow_env, worker):
+    async def test_order_with_address_update_and_approval(self, workflow_env, worker, task_queue, order_id):
         """Test order with both address update and approval"""
-        order_id = "test-integration-002"
-        payment_id = "test-integration-payment-002"
-
         # Start workflow
         handle = await workflow_env.client.start_workflow(
             OrderWorkflow.run,
-            args=[order_id, payment_id],
+            args=order_args(order_id),
             id=order_id,
-            task_queue="order-tq",
+            task_queue=task_queue,
             run_timeout=timedelta(seconds=15),
         )
 
         # Wait for manual approval state
-        await workflow_env.sleep(1)
-
-        # Update address
-        new_address = {
-            "street": "789 Test Ave",
-            "city": "Seattle",
-            "state": "WA",
-            "zip_code": "98101",
-            "country": "USA"
-        }
-        await handle.signal(OrderWorkflow.update_address, new_address)
-
-        # Verify address updated
-        status = await handle.query(OrderWorkflow.status)
-        assert status["updated_address"] == new_address
-
-        # Approve
-        await handle.signal(OrderWorkflow.approve_order)
+        await wait_for_state(handle, "AWAITING_MANUAL_APPROVAL")
+
+        # Update address. It must be recorded before the approval (the address
+        # locks once shipping starts), so only the approval and the check that
+        # the update landed go out together
+        await handle.signal(OrderWorkflow.update_address, dict(_SEATTLE_ADDRESS))
+        status, _ = await asyncio.gather(
+            handle.query(OrderWorkflow.status),
+            handle.signal(OrderWorkflow.approve_order),
+        )
+        assert status["updated_address"] == _SEATTLE_ADDRESS
 
         # Complete workflow
         result = await handle.result()
@@ -354,8 +375,7 @@ class TestIntegration:
 
         # Verify final state
         final_status = await handle.query(OrderWorkflow.status)
-        assert final_status["state"] == "COMPLETED"
-        assert final_status["updated_address"] == new_address
+        assert_status(final_status, state="COMPLETED", updated_address=_SEATTLE_ADDRESS)
 
 
 if __name__ == "__main__":